@@ -0,0 +1,308 @@
+"""Serve the cleaned dataset, its correlations, rankings and group statistics as a JSON API over HTTP.
+
+The API reads the same dataset snapshot as the app and answers from the same indexes. Run from the repository root:
+
+    python api.py --port 8600
+
+Every endpoint answers GET requests. Lists are comma separated, columns= picks the fields of every returned row.
+
+    /               dataset version, number of rows and the columns of the dataset
+    /countries      rows of the countries scoring above min_score in the continents and regions
+    /ranking        rows of the n happiest and the n unhappiest countries
+    /correlations   r, slope and intercept of every metric against the happiness score, for a method
+    /group-stats    box plot statistics by 'Continent' or 'Region', filtered like /countries
+
+Responses carry an ETag, a request with a matching If-None-Match is answered with 304 Not Modified.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import math
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from correlation import METHODS, correlations
+from helper import dataset_version, filter_index, full_data, group_stats
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8600
+
+# Encoded responses kept in memory, by endpoint and normalized query
+DEFAULT_MAX_ENTRIES = 1_024
+
+# Rows returned by /ranking at each end when the request does not ask for a number
+DEFAULT_RANKING = 5
+
+logger = logging.getLogger(__name__)
+
+
+class BadRequest(ValueError):
+    """A query the API cannot answer, reported to the client with status 400."""
+
+
+def json_value(value):
+    # Numbers and arrays of numpy, everything else json.dumps handles itself
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def to_json(payload):
+    # Compact like the records pandas writes
+    return json.dumps(payload, default=json_value, allow_nan=False, separators=(',', ':'))
+
+
+def records(frame):
+    """The rows of a DataFrame as a JSON array of objects, missing values are null."""
+    return frame.to_json(orient='records', double_precision=15)
+
+
+def query_list(query, name):
+    """The comma separated values of a query parameter, None if it is missing."""
+    if name not in query:
+        return None
+    return [value.strip() for values in query[name] for value in values.split(',') if value.strip()]
+
+
+def query_float(query, name, default=None):
+    if name not in query:
+        return default
+    try:
+        value = float(query[name][-1])
+    except ValueError:
+        raise BadRequest(f'{name} must be a number') from None
+    if not math.isfinite(value):
+        raise BadRequest(f'{name} must be a finite number')
+    return value
+
+
+def query_int(query, name, default, minimum=1):
+    if name not in query:
+        return default
+    try:
+        value = int(query[name][-1])
+    except ValueError:
+        raise BadRequest(f'{name} must be an integer') from None
+    if value < minimum:
+        raise BadRequest(f'{name} must be at least {minimum}')
+    return value
+
+
+def checked(values, known, name):
+    """The values of a list parameter, raising BadRequest for any that is not one of known."""
+    unknown = [value for value in values if value not in known]
+    if unknown:
+        raise BadRequest(f'Unknown {name}: {", ".join(unknown)}')
+    return values
+
+
+def columns_of(query, available, default=None):
+    """The columns= projection as a tuple, every available column if it is missing."""
+    columns = query_list(query, 'columns')
+    if columns is None:
+        return tuple(default if default is not None else available)
+    return tuple(checked(columns, set(available), 'columns'))
+
+
+def selection_of(query):
+    """Normalized score, continent and region filters, shared by /countries and /group-stats."""
+    # Thresholds between two distinct scores select the same countries, so they share a cached response
+    min_score = filter_index.snap_min_score(query_float(query, 'min_score', float('-inf')))
+    continents = query_list(query, 'continents')
+    continents = tuple(sorted(checked(continents, filter_index.continent_masks, 'continents')
+                              if continents is not None else filter_index.continent_masks))
+    regions = query_list(query, 'regions')
+    if regions is not None:
+        regions = tuple(sorted(checked(regions, filter_index.region_masks, 'regions')))
+    return min_score, continents, regions
+
+
+def info(query):
+    return (), lambda: to_json({'version': dataset_version, 'rows': len(full_data),
+                                'columns': full_data.columns.tolist()})
+
+
+def countries(query):
+    min_score, continents, regions = selection = selection_of(query)
+    columns = columns_of(query, full_data.columns)
+
+    def respond():
+        rows = full_data.iloc[filter_index.positions(min_score, continents, regions)][list(columns)]
+        return f'{{"version":{json.dumps(dataset_version)},"count":{len(rows)},"rows":{records(rows)}}}'
+    return (*selection, columns), respond
+
+
+def ranking(query):
+    n = query_int(query, 'n', DEFAULT_RANKING)
+    columns = columns_of(query, full_data.columns, default=['Country name', 'Happiness Score'])
+
+    def respond():
+        top, bottom = group_stats.ranking_rows(n)
+        return (f'{{"version":{json.dumps(dataset_version)},"top":{records(full_data.iloc[top][list(columns)])},'
+                f'"bottom":{records(full_data.iloc[bottom][list(columns)])}}}')
+    return (n, columns), respond
+
+
+def correlations_of(query):
+    methods = {method.lower(): method for method in METHODS}
+    requested = query.get('method', ['Pearson'])[-1]
+    if requested.lower() not in methods:
+        raise BadRequest(f'Unknown method: {requested}, one of {", ".join(METHODS)}')
+    method = methods[requested.lower()]
+    columns = columns_of(query, ['r', 'slope', 'intercept'])
+
+    def respond():
+        fits = correlations(full_data, dataset_version, method)[list(columns)]
+        return (f'{{"version":{json.dumps(dataset_version)},"method":{json.dumps(method)},'
+                f'"metrics":{records(fits.rename_axis("metric").reset_index())}}}')
+    return (method, columns), respond
+
+
+def group_stats_of(query):
+    by = query.get('by', ['Continent'])[-1]
+    if by not in ('Continent', 'Region'):
+        raise BadRequest('by must be Continent or Region')
+    min_score, continents, regions = selection = selection_of(query)
+    columns = columns_of(query, ['count', 'q1', 'median', 'q3', 'lowerfence', 'upperfence', 'outlier_scores',
+                                 'outlier_names'])
+
+    def respond():
+        stats = group_stats.box_stats(by, min_score, continents, regions)[list(columns)]
+        groups = [{'group': group, **row} for group, row in zip(stats.index, stats.to_dict('records'))]
+        return to_json({'version': dataset_version, 'by': by, 'groups': groups})
+    return (by, *selection, columns), respond
+
+
+# Every endpoint parses and normalizes its query, and returns the cache key with a function that encodes the answer
+ENDPOINTS = {
+    '/': info,
+    '/countries': countries,
+    '/ranking': ranking,
+    '/correlations': correlations_of,
+    '/group-stats': group_stats_of,
+}
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header is '*' or lists the entity tag, weak or strong, as one of its entries."""
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+class Response:
+    __slots__ = ('body', 'etag')
+
+    def __init__(self, body):
+        self.body = body.encode()
+        self.etag = f'"{dataset_version}-{hashlib.sha1(self.body).hexdigest()[:16]}"'
+
+
+class ResponseCache:
+    """Encoded responses by endpoint and normalized query, the least recently used ones are evicted."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, respond):
+        with self._lock:
+            response = self._entries.get(key)
+            if response is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return response
+            self.misses += 1
+        # Encode outside the lock, so a slow query does not hold up the other requests
+        response = Response(respond())
+        if self.max_entries:
+            with self._lock:
+                self._entries[key] = response
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return response
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class APIHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so a client sends all of its requests over one connection
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, with Nagle's algorithm the body waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+    cache = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        endpoint = ENDPOINTS.get(url.path.rstrip('/') or '/')
+        if endpoint is None:
+            return self.send_json(HTTPStatus.NOT_FOUND, to_json({'error': f'No endpoint {url.path}'}))
+        try:
+            key, respond = endpoint(parse_qs(url.query))
+        except BadRequest as error:
+            return self.send_json(HTTPStatus.BAD_REQUEST, to_json({'error': str(error)}))
+        response = self.cache.get((endpoint.__name__, key), respond)
+
+        if etag_matches(self.headers.get('If-None-Match', ''), response.etag):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', response.etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_json(HTTPStatus.OK, response.body, response.etag)
+
+    def send_json(self, status, body, etag=None):
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+            # Clients may keep the response, but have to revalidate it, which costs a 304 without a body
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('%s %s', self.address_string(), format % args)
+
+
+def make_server(host=DEFAULT_HOST, port=DEFAULT_PORT, max_entries=DEFAULT_MAX_ENTRIES):
+    """A threaded server of the API, with its own response cache (max_entries=0 disables it)."""
+    handler = type('Handler', (APIHandler,), {'cache': ResponseCache(max_entries)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f'address to listen on (default {DEFAULT_HOST})')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'port to listen on (default {DEFAULT_PORT})')
+    parser.add_argument('--cache-entries', type=int, default=DEFAULT_MAX_ENTRIES,
+                        help=f'responses kept in memory, 0 disables the cache (default {DEFAULT_MAX_ENTRIES})')
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, args.cache_entries)
+    print(f'Serving dataset {dataset_version} on http://{args.host}:{server.server_port}/', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Measure the throughput and latency of the JSON API under concurrent clients.
+
+The server runs in this process on a free port. Every client thread keeps one connection open and sends a mix of
+the queries of the data story, with the response cache on and off and with ETag revalidation.
+
+Run from the repository root: python -m benchmarks.api --clients 1,4,16 --requests 2000
+"""
+import argparse
+import http.client
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import numpy as np
+
+import api
+from helper import filter_index
+
+DEFAULT_CLIENTS = '1,4,16'
+DEFAULT_REQUESTS = 2_000
+
+
+def query_mix():
+    """Paths like the ones the page asks for: every continent selection at a few thresholds, rankings and stats."""
+    continents = list(filter_index.continent_masks)
+    paths = ['/', '/ranking', '/ranking?n=10&columns=Country%20name,Continent,Happiness%20Score',
+             '/correlations?method=Pearson', '/correlations?method=Spearman&columns=r',
+             '/group-stats', '/group-stats?by=Region']
+    for min_score, continent in itertools.product((0, 5, 6), continents):
+        selection = f'min_score={min_score}&continents={quote(continent)}'
+        paths.append(f'/countries?{selection}&columns=Country%20name,Happiness%20Score')
+        paths.append(f'/group-stats?by=Region&{selection}')
+    paths.append('/countries')
+    return paths
+
+
+def run_clients(port, paths, clients, requests, revalidate):
+    """Send requests spread over clients threads, return the total seconds and the latency of every request."""
+    per_client = requests // clients
+
+    def client(offset):
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        etags = {}
+        latencies = []
+        for i in range(per_client):
+            path = paths[(offset + i) % len(paths)]
+            headers = {'If-None-Match': etags[path]} if revalidate and path in etags else {}
+            start = time.perf_counter()
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            if response.status not in (200, 304):
+                raise RuntimeError(f'{path}: {response.status}')
+            etags[path] = response.getheader('ETag')
+        connection.close()
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        latencies = list(itertools.chain.from_iterable(pool.map(client, range(0, clients * 7, 7))))
+    return time.perf_counter() - start, np.array(latencies)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', default=DEFAULT_CLIENTS,
+                        help=f'comma separated numbers of concurrent clients (default {DEFAULT_CLIENTS})')
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS,
+                        help=f'requests per run, spread over the clients (default {DEFAULT_REQUESTS})')
+    args = parser.parse_args(argv)
+
+    paths = query_mix()
+    scenarios = [('uncached', 0, False), ('cached', api.DEFAULT_MAX_ENTRIES, False),
+                 ('cached, If-None-Match', api.DEFAULT_MAX_ENTRIES, True)]
+    print(f'{"scenario":<24} {"clients":>7} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8}')
+    for (name, max_entries, revalidate), clients in itertools.product(
+            scenarios, [int(clients) for clients in args.clients.split(',')]):
+        server = api.make_server(port=0, max_entries=max_entries)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            # One unrecorded pass, so the correlations are computed and the cache is filled before timing
+            run_clients(server.server_port, paths, 1, len(paths), revalidate)
+            seconds, latencies = run_clients(server.server_port, paths, clients, args.requests, revalidate)
+        finally:
+            server.shutdown()
+            server.server_close()
+        print(f'{name:<24} {clients:>7} {len(latencies) / seconds:>9.0f} '
+              f'{np.percentile(latencies, 50) * 1000:>8.2f} {np.percentile(latencies, 95) * 1000:>8.2f}', flush=True)
+
+
+if __name__ == '__main__':
+    main()
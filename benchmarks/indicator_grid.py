@@ -0,0 +1,71 @@
+"""Compare build time and payload size of the indicator grid against the old Plotly Express path.
+
+Run from the repository root: python -m benchmarks.indicator_grid
+"""
+import json
+import time
+from math import ceil, floor
+
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.subplots as sp
+import plotly.utils
+
+from charts import TEMPLATE, build_indicators_plot
+from correlation import correlations
+from helper import dataset_version, full_data
+
+REPEATS = 5
+
+
+def build_indicators_plot_px(data, metrics, fits, num_cols=3):
+    """The previous implementation, one px.scatter figure per metric whose traces are copied into the grid."""
+    num_rows = ceil(len(metrics) / num_cols)
+    indicators_plot = sp.make_subplots(rows=num_rows, cols=num_cols, subplot_titles=metrics,
+                                       horizontal_spacing=0.05, vertical_spacing=0.06)
+
+    for i, metric in enumerate(metrics):
+        correlation = round(fits.at[metric, 'r'], 2)
+        scatter_plot = px.scatter(data, x=metric, y='Happiness Score', color='Continent',
+                                  hover_name='Country name', hover_data=['Happiness Score', metric],
+                                  template=TEMPLATE)
+
+        y_fit = fits.at[metric, 'slope'] * data[metric] + fits.at[metric, 'intercept']
+        scatter_plot.add_trace(go.Scatter(x=data[metric], y=y_fit, mode='lines',
+                                          line=dict(color='#0e1117', width=2), name='Trendlinie'))
+
+        current_row = floor(i / num_cols) + 1
+        current_col = i % num_cols + 1
+        for trace in scatter_plot.data:
+            trace.showlegend = (i == 0) and trace.name != 'Trendlinie'
+            indicators_plot.add_trace(trace, row=current_row, col=current_col)
+
+        indicators_plot.update_xaxes(title_text=f"{metric} ({correlation})", row=current_row, col=current_col)
+        indicators_plot.update_yaxes(title_text='Happiness Score', row=current_row, col=current_col)
+
+    total_cols = len(metrics) // 3 + 1
+    indicators_plot.update_layout(height=350 * total_cols, autosize=True, template=TEMPLATE)
+    return indicators_plot
+
+
+def measure(build, metrics, fits):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        figure = build(full_data, metrics, fits)
+        timings.append(time.perf_counter() - start)
+    payload = json.dumps(figure, cls=plotly.utils.PlotlyJSONEncoder)
+    return sorted(timings)[REPEATS // 2], len(payload)
+
+
+def main():
+    fits = correlations(full_data, dataset_version)
+    all_metrics = fits.index.tolist()
+    for metrics in (all_metrics[:12], all_metrics):
+        for name, build in (('plotly express', build_indicators_plot_px), ('graph objects', build_indicators_plot)):
+            seconds, payload_bytes = measure(build, metrics, fits)
+            print(f'{len(metrics):>3} metrics  {name:<15} {seconds * 1000:8.1f} ms  {payload_bytes:>9} bytes')
+
+
+if __name__ == '__main__':
+    main()
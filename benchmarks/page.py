@@ -0,0 +1,44 @@
+"""Measure the time to the first rendered page and the rerun time of every interaction of the data story.
+
+The page is run headless with Streamlit's AppTest. Run from the repository root: python -m benchmarks.page
+"""
+import time
+
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = 'streamlit_app.py'
+TIMEOUT = 120
+
+
+def timed_run(run):
+    start = time.perf_counter()
+    app = run()
+    seconds = time.perf_counter() - start
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+    return seconds
+
+
+def metrics_widget(app):
+    return next(widget for widget in app.multiselect if widget.label == 'correlation_scatter')
+
+
+def main():
+    app = AppTest.from_file(APP_PATH, default_timeout=TIMEOUT)
+    print(f'{"first run":<32} {timed_run(app.run) * 1000:8.1f} ms')
+    print(f'{"rerun without changes":<32} {timed_run(app.run) * 1000:8.1f} ms')
+
+    interactions = [
+        ('score slider', lambda: app.slider[0].set_value(5.0).run()),
+        ('map regions', lambda: app.multiselect[0].set_value(['Europe']).run()),
+        ('boxplot regions', lambda: app.multiselect(key='box_selected_regions').set_value(['Europe', 'Asia']).run()),
+        ('correlation method', lambda: app.selectbox[0].set_value('Spearman').run()),
+        ('indicator metrics', lambda: metrics_widget(app).set_value(metrics_widget(app).options[:3]).run()),
+        ('show dataset', lambda: app.toggle[0].set_value(True).run()),
+    ]
+    for name, interact in interactions:
+        print(f'{name:<32} {timed_run(interact) * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
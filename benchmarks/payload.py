@@ -0,0 +1,91 @@
+"""Measure the payload of every chart as it is sent to the browser, on the real data and on scaled synthetic data.
+
+For every chart the plain Plotly JSON is compared with the compact JSON the app sends, with and without binary typed
+arrays, and every payload also deflated as by the websocket compression of the server. Decoding the JSON stands in
+for the parse time in the browser.
+
+Run from the repository root: python -m benchmarks.payload --scales 1,10,100
+"""
+import argparse
+import json
+import tempfile
+import time
+import zlib
+
+import plotly.utils
+
+import payload
+from benchmarks.suite import TREND_COUNTRIES, scale_history, write_scaled_sources
+from charts import (build_continent_plot, build_happiness_history_plot, build_happiness_map_plot,
+                    build_happiness_trend_plot, build_indicators_plot, build_region_plot, build_top_countries_plot,
+                    indicators_render_mode)
+from correlation import correlations
+from group_stats import GroupStats
+from helper import build_full_data
+from history import load_history
+
+DEFAULT_SCALES = '1,10,100'
+REPEATS = 3
+
+ENCODINGS = {
+    'plain': lambda figure: json.dumps(figure, cls=plotly.utils.PlotlyJSONEncoder),
+    'compact': payload.to_json,
+    'typed arrays': lambda figure: payload.to_json(figure, typed_arrays=True),
+}
+
+
+def deflated_size(spec):
+    # Raw deflate with the default level, like the permessage-deflate extension of the websocket
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return len(compressor.compress(spec.encode()) + compressor.flush())
+
+
+def parse_seconds(spec):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        json.loads(spec)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def chart_figures(data, history):
+    fits = correlations(data, id(data))
+    metrics = fits.index.tolist()
+    group_stats = GroupStats(data)
+    figures = {
+        'map': build_happiness_map_plot(data),
+        'continents': build_continent_plot(group_stats.box_stats('Continent')),
+        'regions': build_region_plot(group_stats.box_stats('Region'), True),
+        'top_countries': build_top_countries_plot(group_stats.ranking(5)),
+        'indicators': build_indicators_plot(data, metrics, fits, indicators_render_mode(len(data), len(metrics))),
+    }
+    if history['Year'].nunique() > 1:
+        figures['history'] = build_happiness_history_plot(history)
+        figures['trend'] = build_happiness_trend_plot(history, TREND_COUNTRIES)
+    return figures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default=DEFAULT_SCALES,
+                        help=f'comma separated row multipliers of the synthetic datasets (default {DEFAULT_SCALES})')
+    args = parser.parse_args(argv)
+
+    history = load_history()
+    print(f'{"":<20} {"encoding":<14} {"bytes":>10} {"deflated":>10} {"encode ms":>10} {"parse ms":>10}')
+    for factor in [int(scale) for scale in args.scales.split(',')]:
+        with tempfile.TemporaryDirectory() as data_dir:
+            write_scaled_sources(data_dir, factor)
+            data = build_full_data(data_dir)
+        for name, figure in chart_figures(data, scale_history(history, factor)).items():
+            for encoding, encode in ENCODINGS.items():
+                start = time.perf_counter()
+                spec = encode(figure)
+                encode_seconds = time.perf_counter() - start
+                print(f'{f"x{factor} {name}":<20} {encoding:<14} {len(spec):>10} {deflated_size(spec):>10} '
+                      f'{encode_seconds * 1000:>10.1f} {parse_seconds(spec) * 1000:>10.2f}', flush=True)
+
+
+if __name__ == '__main__':
+    main()
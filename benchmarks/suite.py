@@ -0,0 +1,243 @@
+"""Time the CSV pipeline stages and every chart builder of the app, on the real data and on synthetic data scaled up
+by whole copies of every country.
+
+Run from the repository root:
+
+    python -m benchmarks.suite --scales 1,10,100,1000 --output results.json
+    python -m benchmarks.suite --compare results.json --threshold 0.25
+
+With --compare the run is checked against an earlier JSON result, every benchmark that got slower by more than the
+threshold is reported and the exit status is 1.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.graph_objects as go
+
+import payload
+
+from charts import (build_continent_plot, build_happiness_history_plot, build_happiness_map_plot,
+                    build_happiness_trend_plot, build_indicators_plot, build_region_plot, build_top_countries_plot,
+                    indicators_render_mode)
+from correlation import METHODS, correlations
+from group_stats import GroupStats
+from helper import SOURCE_FILES, FilterIndex, build_country_index, build_full_data, read_sources, timed
+from history import load_history
+
+DEFAULT_SCALES = '1,10,100'
+DEFAULT_REPEATS = 3
+DEFAULT_THRESHOLD = 0.25
+
+# Slowdowns below this many seconds are timer noise, they are never reported as regressions
+MIN_REGRESSION_SECONDS = 0.002
+
+# Countries compared in the trend plot of the app
+TREND_COUNTRIES = ['Finland', 'Germany', 'United States']
+
+
+def scale_sources(sources, factor, seed=0):
+    """Copy every country of the raw inputs factor times, the copies get a numbered name and their own codes.
+
+    Copies are renamed to their name in continents2.csv, so every copy matches like the original, and their ladder
+    scores are jittered so the filters see distinct scores.
+    """
+    continent_file = sources['continent_file']
+    country_index = build_country_index(continent_file)
+    canonical_names = continent_file.drop_duplicates('country-code').set_index('country-code')['name']
+    code_step = 10 ** len(str(continent_file['country-code'].max()))
+    rng = np.random.default_rng(seed)
+
+    def copies(data, name_column=None):
+        scaled = []
+        for copy in range(factor):
+            data_copy = data.copy()
+            if copy:
+                if name_column is None:
+                    data_copy['name'] = data_copy['name'] + f' {copy}'
+                    data_copy['alpha-3'] = data_copy['alpha-3'] + str(copy)
+                    data_copy['country-code'] = data_copy['country-code'] + copy * code_step
+                else:
+                    names = data_copy[name_column].map(country_index).map(canonical_names)
+                    data_copy[name_column] = names.fillna(data_copy[name_column]) + f' {copy}'
+            scaled.append(data_copy)
+        return pd.concat(scaled, ignore_index=True)
+
+    whr23 = copies(sources['whr23'], 'Country name')
+    whr23['Ladder score'] += rng.normal(0, 0.05, len(whr23)).round(3)
+    return {
+        'whr23': whr23,
+        'world_data': copies(sources['world_data'], 'Country'),
+        'continent_file': copies(continent_file),
+    }
+
+
+def scale_history(history, factor):
+    """Copy every country of the history factor times, with numbered names like scale_sources."""
+    return pd.concat([history.assign(**{'Country name': history['Country name'] + f' {copy}'} if copy else {})
+                      for copy in range(factor)], ignore_index=True)
+
+
+def measure(run, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = run()
+        timings.append(time.perf_counter() - start)
+    return {'seconds': float(np.median(timings)), 'min_seconds': min(timings), 'repeats': repeats}, result
+
+
+def payload_bytes(figures):
+    return sum(len(payload.to_json(figure)) for figure in figures)
+
+
+def benchmark_etl(data_dir, repeats):
+    """Median seconds of every pipeline stage, and of the whole pipeline."""
+    stage_runs = []
+    for _ in range(repeats):
+        timings = {}
+        with timed(timings, 'total'):
+            data = build_full_data(data_dir, timings=timings)
+        stage_runs.append(timings)
+    results = {f'etl/{stage}': {'seconds': float(np.median([run[stage] for run in stage_runs])),
+                                'min_seconds': min(run[stage] for run in stage_runs), 'repeats': repeats}
+               for stage in stage_runs[0]}
+    return results, data
+
+
+def benchmark_builders(data, history, repeats):
+    """Time every builder with the parameters the page offers, sweeps are timed as a whole."""
+    results = {}
+    index = FilterIndex(data)
+    continents = list(index.continent_masks)
+    # Every non-empty combination of selected continents, like the region multiselects of the page
+    combinations = [list(combination) for size in range(1, len(continents) + 1)
+                    for combination in itertools.combinations(continents, size)]
+
+    def record(name, run, cases=1):
+        result, output = measure(run, repeats)
+        result['cases'] = cases
+        figures = output if isinstance(output, list) else [output]
+        if all(isinstance(figure, go.Figure) for figure in figures):
+            result['payload_bytes'] = payload_bytes(figures)
+        results[name] = result
+
+    record('filter_index', lambda: FilterIndex(data))
+    record('group_stats', lambda: GroupStats(data))
+    group_stats = GroupStats(data)
+    record('filter/positions', lambda: [index.positions(5.0, combination, index.regions_of(combination))
+                                        for combination in combinations], len(combinations))
+    for method in METHODS:
+        # A new version for every run, so the correlations are computed instead of taken from the cache
+        record(f'correlations/{method}',
+               lambda method=method: correlations(data, time.perf_counter_ns(), method))
+
+    record('build/map', lambda: build_happiness_map_plot(data))
+    record('build/map/every_region_combination',
+           lambda: [build_happiness_map_plot(data.iloc[index.positions(0.0, combination)])
+                    for combination in combinations], len(combinations))
+    record('build/continents', lambda: build_continent_plot(group_stats.box_stats('Continent')))
+    record('build/regions/every_region_combination',
+           lambda: [build_region_plot(group_stats.box_stats('Region', 0.0, combination),
+                                      len(combination) == len(continents)) for combination in combinations],
+           len(combinations))
+    record('build/top_countries', lambda: build_top_countries_plot(group_stats.ranking(5)))
+
+    fits = correlations(data, id(data))
+    metrics = fits.index.tolist()
+    render_mode = indicators_render_mode(len(data), len(metrics))
+    record(f'build/indicators/all_metrics/{render_mode}', lambda: build_indicators_plot(data, metrics, fits,
+                                                                                        render_mode))
+
+    if history['Year'].nunique() > 1:
+        record('build/history', lambda: build_happiness_history_plot(history))
+        record('build/trend', lambda: build_happiness_trend_plot(history, TREND_COUNTRIES))
+    return results
+
+
+def write_scaled_sources(data_dir, factor):
+    for name, data in scale_sources(read_sources(), factor).items():
+        data.to_csv(os.path.join(data_dir, SOURCE_FILES[name]), index=False)
+
+
+def run_suite(scales, repeats):
+    results = {}
+    history = load_history()
+    # Unrecorded first pass, so the one-off imports and validator setup of plotly are not counted
+    benchmark_builders(build_full_data(), history, 1)
+    for factor in scales:
+        # The biggest datasets take seconds per builder, a single run is enough to see a regression there
+        scale_repeats = repeats if factor < 100 else 1
+        with tempfile.TemporaryDirectory() as data_dir:
+            write_scaled_sources(data_dir, factor)
+            etl_results, data = benchmark_etl(data_dir, scale_repeats)
+        builder_results = benchmark_builders(data, scale_history(history, factor), scale_repeats)
+        for name, result in {**etl_results, **builder_results}.items():
+            results[f'x{factor}/{name}'] = {'rows': len(data), **result}
+            print(f'x{factor:<5} {name:<48} {result["seconds"] * 1000:10.1f} ms', flush=True)
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'plotly': plotly.__version__,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return the benchmarks that are slower than in baseline by more than threshold, with their ratio."""
+    regressions = {}
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['seconds']
+        ratio = result['seconds'] / before if before else float('inf')
+        if ratio > 1 + threshold and result['seconds'] - before > MIN_REGRESSION_SECONDS:
+            regressions[name] = ratio
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default=DEFAULT_SCALES,
+                        help=f'comma separated row multipliers of the synthetic datasets (default {DEFAULT_SCALES})')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS,
+                        help=f'runs per benchmark, the median is reported (default {DEFAULT_REPEATS})')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to check for regressions')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'relative slowdown reported as a regression (default {DEFAULT_THRESHOLD})')
+    args = parser.parse_args(argv)
+
+    results = run_suite([int(scale) for scale in args.scales.split(',')], args.repeats)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.threshold)
+        for name, ratio in sorted(regressions.items(), key=lambda item: -item[1]):
+            print(f'REGRESSION {name}: {ratio:.2f}x {baseline["results"][name]["seconds"] * 1000:.1f} ms -> '
+                  f'{results[name]["seconds"] * 1000:.1f} ms')
+        print(f'{len(regressions)} of {len(results)} benchmarks slower by more than {args.threshold:.0%}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
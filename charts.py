@@ -0,0 +1,281 @@
+from math import ceil
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.subplots as sp
+
+from helper import continent_color_map, region_color_map
+
+# Passed to every figure, the global plotly.io default is replaced by Streamlit when it is imported
+TEMPLATE = 'simple_white'
+
+RENDER_MODES = {'svg': 'SVG', 'webgl': 'WebGL', 'webgl-downsampled': 'WebGL, down-sampled'}
+
+# Above this many points in the indicator grid it is drawn with WebGL instead of SVG
+WEBGL_THRESHOLD = 5_000
+
+# Above this many rows the points of every indicator subplot are density binned
+DOWNSAMPLE_THRESHOLD = 2_000
+
+
+def build_happiness_map_plot(data, resolution=110):
+    """Choropleth of the happiness score, keyed by ISO-3 code.
+
+    plotly.js draws the map with its own world topojson, resolution picks its level of detail (110 or 50, the
+    scale 1:110m is the coarser one). ISO-3 codes are looked up directly, country names need a regex match per
+    country in the browser.
+    """
+    happiness_map_plot = go.Figure(go.Choropleth(locations=data['Country code'],
+                                                 locationmode='ISO-3',
+                                                 z=data['Happiness Score'],
+                                                 coloraxis='coloraxis',
+                                                 hovertext=data['Country name'],
+                                                 hovertemplate='<b>%{hovertext}</b><br><br>'
+                                                               'Happiness Score=%{z}<extra></extra>',
+                                                 marker_line_width=0))
+
+    happiness_map_plot.update_layout(coloraxis=dict(colorscale='viridis', colorbar_title_text='Happiness Score'),
+                                     margin=dict(t=60), height=800, dragmode=False, template=TEMPLATE)
+    happiness_map_plot.update_geos(resolution=resolution, showocean=True, oceancolor="#fffec6")
+    return happiness_map_plot
+
+
+def build_happiness_history_plot(history):
+    """Choropleth of the happiness score with one animation frame per report year."""
+    happiness_history_plot = px.choropleth(history,
+                                           locations="Country code",
+                                           locationmode='ISO-3',
+                                           color="Happiness Score",
+                                           hover_name="Country name",
+                                           animation_frame="Year",
+                                           range_color=[history["Happiness Score"].min(),
+                                                        history["Happiness Score"].max()],
+                                           color_continuous_scale='viridis',
+                                           height=800, template=TEMPLATE)
+
+    happiness_history_plot.update_geos(showocean=True, oceancolor="#fffec6")
+    happiness_history_plot.update_layout(dragmode=False)
+    happiness_history_plot.update_traces(marker_line_width=0)
+    return happiness_history_plot
+
+
+def build_happiness_trend_plot(history, countries):
+    trend_data = history[history["Country name"].isin(countries)]
+    happiness_trend_plot = px.line(trend_data, x="Year", y="Happiness Score", color="Country name", markers=True,
+                                   height=500, template=TEMPLATE)
+    happiness_trend_plot.update_xaxes(dtick=1)
+    return happiness_trend_plot
+
+
+def build_box_plot(box_stats, by, color_map, height):
+    """Horizontal box plot of the happiness score by group, drawn from precomputed statistics.
+
+    box_stats comes from GroupStats.box_stats, the boxes are listed from the top down. The outliers are drawn as
+    markers on the center line of their box, like the outlier points plotly.js draws for a box of raw points.
+    """
+    traces = []
+    for group, stats in box_stats.iterrows():
+        color = color_map.get(group)
+        traces.append(go.Box(y=[group], q1=[stats['q1']], median=[stats['median']], q3=[stats['q3']],
+                             lowerfence=[stats['lowerfence']], upperfence=[stats['upperfence']],
+                             name=group, legendgroup=group, marker_color=color, orientation='h'))
+        if len(stats['outlier_scores']):
+            traces.append(go.Scatter(x=stats['outlier_scores'], y=[group] * len(stats['outlier_scores']),
+                                     customdata=stats['outlier_names'], mode='markers', name=group,
+                                     legendgroup=group, marker_color=color, showlegend=False,
+                                     hovertemplate=f'{by}=%{{y}}<br>Happiness Score=%{{x}}<br>'
+                                                   'Country name=%{customdata}<extra></extra>'))
+
+    # Categories are placed from the bottom up, so the first box is drawn at the top
+    box_plot = go.Figure(traces, layout=dict(yaxis=dict(categoryorder='array',
+                                                        categoryarray=box_stats.index[::-1].tolist()),
+                                             legend=dict(title_text=by, tracegroupgap=0), boxmode='overlay',
+                                             margin=dict(t=60), height=height, template=TEMPLATE))
+    return box_plot
+
+
+def build_continent_plot(box_stats):
+    continent_plot = build_box_plot(box_stats, 'Continent', continent_color_map, height=600)
+
+    continent_plot.update_layout(xaxis_title='Happiness Score', yaxis_title='Continent')
+    continent_plot.update_layout(autosize=True)
+    return continent_plot
+
+
+def build_region_plot(box_stats, show_the_west):
+    region_plot = build_box_plot(box_stats, 'Region', region_color_map, height=1200)
+
+    region_plot.update_layout(yaxis_title='Sub Region', xaxis_title='Happiness Score', autosize=True)
+    # The annotations only line up with the boxes when every region is shown
+    if show_the_west:
+        text = """<span style='font-size:28px; color:#0e1117'>The West</span>"""
+        region_plot.add_annotation(
+            x=5.5, y=12.7,  # Text annotation position
+            xref="x", yref="y",  # Coordinate reference system
+            text=text,  # Text content
+            showarrow=False,
+        )
+
+        region_plot.add_shape(
+            type="rect",
+            x0=4.9, y0=13.5, x1=8, y1=7.5,  # Define the coordinates of the rectangle's corners
+            line=dict(
+                color="#0e1117",
+                width=5,
+            ),
+            opacity=1,
+            fillcolor="rgba(0, 0, 0, 0)",
+        )
+
+        region_plot.add_annotation(
+            x=2.37, y=3.1,
+            xref="x", yref="y",  # Coordinate reference system
+            text="Lebanon",  # Text content
+            arrowcolor="#0e1117",
+        )
+
+        region_plot.add_annotation(
+            x=1.834, y=1.1,
+            xref="x", yref="y",  # Coordinate reference system
+            text="Afghanistan",  # Text content
+            arrowcolor="#0e1117",
+        )
+    return region_plot
+
+
+def build_top_countries_plot(ranking):
+    # The top 5 and bottom 5 countries of GroupStats.ranking
+    df_concat = ranking.to_frame().sort_values(by="Happiness Score")
+
+    # bar chart horizontal
+    top_countries_plot = px.bar(df_concat, x="Happiness Score", y=df_concat.index, orientation='h', height=600,
+                                color='Happiness Score', color_continuous_scale='viridis', template=TEMPLATE)
+    top_countries_plot.update_layout(xaxis_title='Happiness Score', yaxis_title='Country name')
+    top_countries_plot.update_layout(autosize=True)
+
+    top_countries_plot.add_annotation(  # add a text callout with arrow
+        text="Neighbours!", x=7.5, y=3, showarrow=False
+    )
+
+    top_countries_plot.add_shape(
+        type="path",
+        path="M 2.5, 1 Q 8,2 7.6,6",
+        line=dict(
+            color="#0e1117",
+            width=2,
+        ),
+        fillcolor="rgba(0, 0, 0, 0)",
+        opacity=1
+    )
+    return top_countries_plot
+
+
+def indicators_render_mode(num_rows, num_metrics, requested='auto', max_points=DOWNSAMPLE_THRESHOLD):
+    """Resolve the render mode of the indicator grid, 'auto' picks it by the number of points."""
+    if requested != 'auto':
+        return requested
+    if num_rows > max_points:
+        return 'webgl-downsampled'
+    if num_rows * num_metrics > WEBGL_THRESHOLD:
+        return 'webgl'
+    return 'svg'
+
+
+def density_bins(x, y, codes, bins):
+    """Replace the points of every group by the mean point of each occupied cell of a bins x bins grid.
+
+    Returns x, y, group code and number of points of every occupied cell.
+    """
+    def cell_index(values):
+        low, high = values.min(), values.max()
+        scale = bins / (high - low) if high > low else 0
+        return np.minimum(((values - low) * scale).astype(np.int64), bins - 1)
+
+    cells = (codes * bins + cell_index(x)) * bins + cell_index(y)
+    cells, inverse, counts = np.unique(cells, return_inverse=True, return_counts=True)
+    return np.bincount(inverse, x) / counts, np.bincount(inverse, y) / counts, cells // (bins * bins), counts
+
+
+def build_indicators_plot(data, metrics, fits, render_mode='svg', max_points=DOWNSAMPLE_THRESHOLD, num_cols=3):
+    """Scatter every metric against the happiness score in a grid of subplots, with its regression line.
+
+    The rows are split by continent once and every subplot reuses the same groups, the traces are added to the
+    figure in one call instead of one Plotly Express figure per metric. In 'webgl-downsampled' mode every subplot
+    shows at most about max_points density binned points, the regression line is still fitted on every row.
+    """
+    num_rows = ceil(len(metrics) / num_cols)
+    scatter = go.Scatter if render_mode == 'svg' else go.Scattergl
+    downsample = render_mode == 'webgl-downsampled'
+
+    # Create a subplot figure with titles
+    indicators_plot = sp.make_subplots(rows=num_rows, cols=num_cols, subplot_titles=metrics,
+                                       horizontal_spacing=0.05, vertical_spacing=0.06)
+
+    happiness = data['Happiness Score'].to_numpy()
+    country_names = data['Country name'].to_numpy()
+    continent_codes, continents = pd.factorize(data['Continent'])
+    continent_rows = {continent: np.flatnonzero(continent_codes == code) for code, continent in enumerate(continents)}
+    continent_scores = {continent: happiness[rows] for continent, rows in continent_rows.items()}
+    continent_names = {continent: country_names[rows] for continent, rows in continent_rows.items()}
+    # Grid size that keeps the binned points of all continents together below max_points
+    bins = max(int(np.sqrt(max_points / len(continents))), 1)
+
+    traces = []
+    axis_titles = {}
+    for i, metric in enumerate(metrics):
+        # Subplots are numbered row by row, the first one uses the axes without a number
+        subplot = '' if i == 0 else str(i + 1)
+        values = data[metric].to_numpy()
+        if downsample:
+            binned_x, binned_y, binned_codes, binned_counts = density_bins(values, happiness, continent_codes, bins)
+
+        for code, (continent, rows) in enumerate(continent_rows.items()):
+            if downsample:
+                cells = binned_codes == code
+                x, y = binned_x[cells], binned_y[cells]
+                hovertext = [f'{count} countries' for count in binned_counts[cells]]
+            else:
+                x, y, hovertext = values[rows], continent_scores[continent], continent_names[continent]
+
+            traces.append(scatter(
+                x=x,
+                y=y,
+                hovertext=hovertext,
+                hovertemplate=f'<b>%{{hovertext}}</b><br><br>Continent={continent}<br>{metric}=%{{x}}<br>'
+                              f'Happiness Score=%{{y}}<extra></extra>',
+                legendgroup=continent,
+                name=continent,
+                marker=dict(color=continent_color_map[continent], symbol='circle'),
+                mode='markers',
+                showlegend=(i == 0),  # Show legend only for the first subplot
+                xaxis=f'x{subplot}',
+                yaxis=f'y{subplot}',
+            ))
+
+        # A straight line only needs its end points
+        m = fits.at[metric, 'slope']
+        b = fits.at[metric, 'intercept']
+        x_range = [values.min(), values.max()]
+        traces.append(scatter(
+            x=x_range,
+            y=[m * value + b for value in x_range],
+            mode='lines',
+            line=dict(color='#0e1117', width=2),
+            name='Trendlinie',
+            showlegend=False,
+            xaxis=f'x{subplot}',
+            yaxis=f'y{subplot}',
+        ))
+
+        correlation = round(fits.at[metric, 'r'], 2)
+        axis_titles[f'xaxis{subplot}'] = dict(title=dict(text=f"{metric} ({correlation})"))
+        axis_titles[f'yaxis{subplot}'] = dict(title=dict(text='Happiness Score'))
+
+    indicators_plot.add_traces(traces)
+
+    # Update the layout if needed, e.g., autosize, or adjusting margins
+    total_cols = len(metrics) // 3 + 1
+    indicators_plot.update_layout(axis_titles, height=350 * total_cols, autosize=True, template=TEMPLATE)
+    return indicators_plot
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+# Values kept per column for the median, up to this many values the median is exact
+RESERVOIR_SIZE = 4_096
+
+# Fill values of the imputation strategies: the statistic and whether it is taken per group
+IMPUTE_STRATEGIES = {
+    'mean': ('mean', False),
+    'median': ('median', False),
+    'group mean': ('mean', True),
+    'group median': ('median', True),
+}
+
+
+class RunningStats:
+    """Count, mean and sum of squared deviations (M2) of every column, updated chunk by chunk.
+
+    The chunks are combined with Chan's parallel update, so nothing is rescanned when rows are appended. For the
+    median a uniform reservoir sample of reservoir_size values is kept per column.
+    """
+
+    def __init__(self, columns, reservoir_size=RESERVOIR_SIZE, seed=0):
+        self.columns = list(columns)
+        self.count = np.zeros(len(self.columns))
+        self.mean = np.zeros(len(self.columns))
+        self.m2 = np.zeros(len(self.columns))
+        self.reservoir_size = reservoir_size
+        self.samples = [np.empty(0) for _ in self.columns]
+        self._rng = np.random.default_rng(seed)
+
+    def append(self, values):
+        """Add the rows of a 2-d float array with one column per tracked column, NaN values are skipped."""
+        present = ~np.isnan(values)
+        count = present.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(count > 0, np.nansum(values, axis=0) / count, 0.0)
+        m2 = np.nansum((values - mean) ** 2, axis=0)
+
+        total = self.count + count
+        delta = mean - self.mean
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.mean = np.where(self.count == 0, mean, self.mean + delta * np.where(total > 0, count / total, 0))
+            self.m2 = self.m2 + m2 + np.where(total > 0, delta ** 2 * self.count * count / total, 0)
+
+        for i in range(len(self.columns)):
+            self._sample(i, values[present[:, i], i], int(self.count[i]))
+        self.count = total
+
+    def _sample(self, i, new_values, seen):
+        # Algorithm R: the first values fill the reservoir, value number k replaces a random one with probability
+        # reservoir_size / k
+        free = max(self.reservoir_size - len(self.samples[i]), 0)
+        if free:
+            self.samples[i] = np.concatenate([self.samples[i], new_values[:free]])
+        rest = new_values[free:]
+        if len(rest):
+            slots = self._rng.integers(0, seen + free + np.arange(1, len(rest) + 1))
+            kept = slots < self.reservoir_size
+            self.samples[i][slots[kept]] = rest[kept]
+
+    def variance(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count > 1, self.m2 / (self.count - 1), np.nan)
+
+    def median(self):
+        return np.array([np.median(sample) if len(sample) else np.nan for sample in self.samples])
+
+    def summary(self):
+        """Count, mean, standard deviation and median of every column."""
+        return pd.DataFrame({
+            'count': self.count.astype('int64'),
+            'mean': np.where(self.count > 0, self.mean, np.nan),
+            'std': np.sqrt(self.variance()),
+            'median': self.median(),
+        }, index=self.columns)
+
+
+class StatsStore:
+    """Running statistics of every column, over all rows and per group of group_column.
+
+    Rows are appended as they are cleaned, so the fill values of the imputation and summary statistics never
+    need a scan over the whole dataset.
+    """
+
+    def __init__(self, columns, group_column, reservoir_size=RESERVOIR_SIZE):
+        self.columns = list(columns)
+        self.group_column = group_column
+        self.reservoir_size = reservoir_size
+        self.total = RunningStats(self.columns, reservoir_size)
+        self.groups = {}
+
+    def append(self, data):
+        values = data[self.columns].to_numpy(dtype=np.float64)
+        self.total.append(values)
+        for group, rows in data.groupby(self.group_column, sort=False).indices.items():
+            if group not in self.groups:
+                self.groups[group] = RunningStats(self.columns, self.reservoir_size, seed=len(self.groups) + 1)
+            self.groups[group].append(values[rows])
+
+    def summary(self, group=None):
+        return (self.total if group is None else self.groups[group]).summary()
+
+    def fill_values(self, strategy='mean'):
+        """Fill values of a strategy: a Series by column, or for group strategies a DataFrame by group and column.
+
+        Groups without a value in a column get the value over all rows.
+        """
+        statistic, by_group = IMPUTE_STRATEGIES[strategy]
+        overall = self.summary()[statistic]
+        if not by_group:
+            return overall
+        return pd.DataFrame({group: stats.summary()[statistic] for group, stats in self.groups.items()}).T.fillna(
+            overall)
+
+    def impute(self, data, strategy='mean'):
+        """Fill the missing values of the tracked columns of data in place, only the missing cells are written."""
+        statistic, by_group = IMPUTE_STRATEGIES[strategy]
+        overall = self.summary()[statistic]
+        group_values = self.fill_values(strategy) if by_group else None
+        for column in self.columns:
+            missing = data[column].isna()
+            if not missing.any():
+                continue
+            if by_group:
+                # Rows of a group that was never appended get the value over all rows
+                fill = data.loc[missing, self.group_column].map(group_values[column]).fillna(overall[column])
+            else:
+                fill = overall[column]
+            data.loc[missing, column] = fill
@@ -0,0 +1,116 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+METHODS = ['Pearson', 'Spearman', 'Theil-Sen']
+
+# Theil-Sen looks at every pair of rows, above this many pairs a fixed random sample of pairs is used instead
+MAX_PAIRS = 1_000_000
+
+# Metric columns whose pairwise differences Theil-Sen holds at once, 4 columns of a million pairs take 32 MB per array
+THEIL_SEN_BLOCK = 4
+
+# Fits of the latest dataset version by (version, method, target), with a lock per key while one is computed
+_cache = {}
+_key_locks = {}
+_locks_lock = threading.Lock()
+
+
+def correlations(data, version, method='Pearson', target='Happiness Score'):
+    """Return r, slope and intercept of every numeric column against target, computed once per dataset version.
+
+    For Pearson the line is the least squares fit. Spearman correlates the ranks and keeps the least squares line,
+    Theil-Sen uses the median pairwise slope with Kendall's tau as its correlation.
+    """
+    key = (version, method, target)
+    fits = _cache.get(key)
+    if fits is not None:
+        return fits
+    # Callers asking for the same fits wait for one computation, the other methods are not held up by it
+    with _locks_lock:
+        lock = _key_locks.setdefault(key, threading.Lock())
+    with lock:
+        fits = _cache.get(key)
+        if fits is None:
+            fits = compute_correlations(data, method, target)
+            with _locks_lock:
+                for old_key in [old_key for old_key in _key_locks if old_key[0] != version]:
+                    _cache.pop(old_key, None)
+                    del _key_locks[old_key]
+                _cache[key] = fits
+    return fits
+
+
+def compute_correlations(data, method, target):
+    metrics = data.select_dtypes(include='number').columns.drop(target)
+    x = data[metrics].to_numpy(dtype=np.float64)
+    y = data[target].to_numpy(dtype=np.float64)
+    if method == 'Pearson':
+        r, slope, intercept = least_squares(x, y)
+    elif method == 'Spearman':
+        ranks = data[metrics].rank().to_numpy(dtype=np.float64)
+        r, _, _ = least_squares(ranks, data[target].rank().to_numpy(dtype=np.float64))
+        _, slope, intercept = least_squares(x, y)
+    elif method == 'Theil-Sen':
+        r, slope, intercept = theil_sen(x, y)
+    else:
+        raise ValueError(f'Unknown correlation method: {method}')
+    return pd.DataFrame({'r': r, 'slope': slope, 'intercept': intercept}, index=metrics)
+
+
+def least_squares(x, y):
+    """Pearson r and least squares slope and intercept of y against every column of x, in one matrix pass."""
+    x_mean = x.mean(axis=0)
+    y_mean = y.mean()
+    x_centered = x - x_mean
+    y_centered = y - y_mean
+
+    covariance = x_centered.T @ y_centered
+    x_variance = np.einsum('ij,ij->j', x_centered, x_centered)
+    y_variance = y_centered @ y_centered
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = covariance / np.sqrt(x_variance * y_variance)
+        slope = covariance / x_variance
+    return r, slope, y_mean - slope * x_mean
+
+
+def theil_sen(x, y):
+    """Kendall's tau and Theil-Sen slope and intercept of y against every column of x."""
+    n = len(y)
+    if n * (n - 1) // 2 > MAX_PAIRS:
+        # Draw the pairs directly, listing all of them first needs memory quadratic in the number of rows
+        rng = np.random.default_rng(0)
+        first = rng.integers(0, n, MAX_PAIRS)
+        second = rng.integers(0, n - 1, MAX_PAIRS)
+        second += second >= first
+    else:
+        first, second = np.triu_indices(n, k=1)
+
+    dy = y[second] - y[first]
+    dy_sign = np.sign(dy)
+
+    # The differences of every pair take a million rows per column, so the columns are processed a block at a time
+    columns = x.shape[1]
+    slope = np.empty(columns)
+    concordance = np.empty(columns)
+    x_untied = np.empty(columns, dtype=np.int64)
+    for start in range(0, columns, THEIL_SEN_BLOCK):
+        block = slice(start, start + THEIL_SEN_BLOCK)
+        dx = x[second, block]
+        dx -= x[first, block]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slopes = dy[:, np.newaxis] / dx
+        # Pairs with the same x value have no slope
+        slopes[dx == 0] = np.nan
+        slope[block] = np.nanmedian(slopes, axis=0)
+        concordance[block] = np.sign(dx).T @ dy_sign
+        x_untied[block] = np.count_nonzero(dx, axis=0)
+    intercept = np.median(y[:, np.newaxis] - slope * x, axis=0)
+
+    # Kendall's tau-b, ties are left out of the normalization
+    y_untied = np.count_nonzero(dy)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tau = concordance / np.sqrt(x_untied * y_untied)
+    return tau, slope, intercept
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+import plotly.graph_objects as go
+import streamlit as st
+from streamlit.proto.PlotlyChart_pb2 import PlotlyChart as PlotlyChartProto
+
+import payload
+import profiling
+from helper import SNAPSHOT_DIR
+
+# Upper bound for the serialized figures one cache keeps in memory
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Output of prerender.py, the figure specs and a manifest that maps their cache keys onto the files
+PRERENDERED_DIR = os.path.join(SNAPSHOT_DIR, 'prerendered')
+PRERENDERED_MANIFEST = 'manifest.json'
+
+
+class CachedFigure(NamedTuple):
+    # Only the Plotly JSON is kept, so the size of the cache is the size of its specs
+    spec: str
+
+
+def serialize(figure):
+    """The Plotly JSON that is sent for a figure, for figures that are sent without being cached."""
+    with profiling.span('serialize'):
+        return CachedFigure(payload.to_json(figure))
+
+
+def figure_name(key):
+    # Keys of filtered figures are tuples that start with the name of the figure
+    return key[0] if isinstance(key, tuple) else key
+
+
+def manifest_key(key):
+    """The key of a figure in the manifest of the pre-rendered figures."""
+    return json.dumps(key)
+
+
+class Prerendered:
+    """Figure specs written by prerender.py, looked up by their cache key and version (see figures.FIGURES_VERSION).
+
+    The manifest is read again when prerender.py replaces it, so a running app picks up a new export.
+    """
+
+    def __init__(self, directory=PRERENDERED_DIR):
+        self.directory = directory
+        # Version and files of the manifest, replaced as a whole so readers never see half of an update
+        self.manifest = (None, {})
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """The spec of a pre-rendered figure, or None if there is none for this key and version."""
+        self._refresh()
+        manifest_version, files = self.manifest
+        file = files.get(manifest_key(key)) if version == manifest_version else None
+        if file is None:
+            return None
+        try:
+            with open(os.path.join(self.directory, file)) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _refresh(self):
+        path = os.path.join(self.directory, PRERENDERED_MANIFEST)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.manifest = (None, {})
+            self._signature = None
+            return
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if signature == self._signature:
+            return
+        with self._lock:
+            with open(path) as f:
+                manifest = json.load(f)
+            self.manifest = (manifest['version'], manifest['figures'])
+            self._signature = signature
+
+
+class FigureCache:
+    """Process-wide cache of the Plotly JSON of built figures, shared by all sessions.
+
+    Entries belong to a dataset version, a lookup with a different version drops every entry of the old one.
+    When the serialized figures exceed max_bytes (or max_entries) the least recently used ones are evicted.
+    Only the specs are kept, figures are built, serialized and then dropped.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_entries=None, prerendered=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.prerendered = prerendered
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version, build):
+        """Return the cached figure for key, building it with build() on a miss."""
+        with self._lock:
+            if version != self.version:
+                self._invalidate(version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                profiling.count('figure_cache.hits')
+                return entry
+            self.misses += 1
+        profiling.count('figure_cache.misses')
+
+        spec = self.prerendered.get(key, version) if self.prerendered is not None else None
+        if spec is not None:
+            profiling.count('figure_cache.prerendered')
+            entry = CachedFigure(spec)
+        else:
+            # Build outside the lock, so a slow build does not block the other sessions
+            with profiling.span(f'build {figure_name(key)}'):
+                figure = build()
+            entry = serialize(figure)
+
+        with self._lock:
+            if version == self.version and key not in self._entries:
+                self._entries[key] = entry
+                self.size += len(entry.spec)
+                self._evict()
+        return entry
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._invalidate(None)
+
+    def _invalidate(self, version):
+        self._entries.clear()
+        self.size = 0
+        self.version = version
+
+    def _evict(self):
+        while self._entries and (self.size > self.max_bytes
+                                 or (self.max_entries is not None and len(self._entries) > self.max_entries)):
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted.spec)
+
+
+prerendered = Prerendered()
+
+# Figures that do not depend on any widget, they only change with the dataset
+static_figures = FigureCache(prerendered=prerendered)
+
+# Figures of filtered data, keyed by the normalized filter parameters
+filtered_figures = FigureCache(max_entries=128, prerendered=prerendered)
+
+
+def plotly_chart(cached_figure, use_container_width=False, theme='streamlit'):
+    """Like st.plotly_chart, but sends the already serialized spec of a cached figure."""
+    profiling.count('figure_json_bytes', len(cached_figure.spec))
+    profiling.count('charts')
+    with profiling.span('plotly_chart'):
+        # The message is built like st.plotly_chart of Streamlit 1.37.1 builds it, the version this was checked
+        # against. Versions with another message layout go through st.plotly_chart, which serializes the figure again.
+        if not {'spec', 'config', 'id'}.issubset(PlotlyChartProto.DESCRIPTOR.fields_by_name):
+            # The spec was validated when it was built, validating it again costs more than the rebuild
+            figure = go.Figure(json.loads(cached_figure.spec), _validate=False)
+            return st.plotly_chart(figure, use_container_width=use_container_width, theme=theme)
+        proto = PlotlyChartProto()
+        proto.use_container_width = use_container_width
+        proto.theme = theme or ''
+        proto.spec = cached_figure.spec
+        proto.config = json.dumps({'showLink': False, 'linkText': False})
+        # The frontend keeps the zoom and pan of a chart under its id, which has to stay the same across reruns
+        proto.id = f'plotly_chart-{hashlib.md5(f"{proto.spec}{use_container_width}{theme}".encode()).hexdigest()}'
+        return st._main._enqueue('plotly_chart', proto)
@@ -0,0 +1,113 @@
+import hashlib
+import importlib
+from typing import Callable, Hashable, NamedTuple
+
+from charts import (DOWNSAMPLE_THRESHOLD, build_continent_plot, build_happiness_history_plot,
+                    build_happiness_map_plot, build_happiness_trend_plot, build_indicators_plot, build_region_plot,
+                    build_top_countries_plot)
+from correlation import correlations
+from figure_cache import FigureCache, filtered_figures, static_figures
+from helper import dataset_version, filter_index, full_data, group_stats
+from history import load_history
+
+# Metrics of the indicator grid when the reader has not picked any
+DEFAULT_METRICS = ['Social support',
+                   'Logged GDP per capita',
+                   'Healthy life expectancy',
+                   'Tertiary education enrollment',
+                   'Infant mortality',
+                   'Birth Rate',
+                   'Physicians per thousand',
+                   'Freedom to make life choices',
+                   'Urban population percentage',
+                   'Maternal mortality ratio',
+                   'Co2-Emissions per capita',
+                   'Minimum wage']
+
+# Countries of the trend plot when the page is opened
+DEFAULT_TREND_COUNTRIES = ['Finland', 'Germany', 'United States']
+
+# Modules that compute what the charts draw: the traces and layouts, the fitted lines of the indicators, the quartiles,
+# fences and rankings of the box and bar charts and the encoding of the specs
+FIGURE_MODULES = ['charts', 'correlation', 'group_stats', 'payload', __name__]
+
+
+def figures_version():
+    """Dataset version and a hash of the figure code, pre-rendered figures are only served while both match."""
+    digest = hashlib.sha256(dataset_version.encode())
+    for module in FIGURE_MODULES:
+        with open(importlib.import_module(module).__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+FIGURES_VERSION = figures_version()
+
+
+class FigureRequest(NamedTuple):
+    """A chart of the data story for some widget values, with the cache key that identifies it.
+
+    The app and prerender.py both go through the functions below, so a pre-rendered figure is found under the same
+    key the app looks up for the same widget values.
+    """
+    cache: FigureCache
+    key: Hashable
+    build: Callable
+
+    def get(self):
+        """The cached figure, built on a miss."""
+        return self.cache.get(self.key, FIGURES_VERSION, self.build)
+
+
+def happiness_map_plot(min_score, continents):
+    # Slider positions between two distinct scores select the same countries and share a cache entry
+    score = filter_index.snap_min_score(min_score)
+    continents = tuple(sorted(continents))
+    return FigureRequest(filtered_figures, ('happiness_map_plot', score, continents),
+                         lambda: build_happiness_map_plot(full_data.iloc[filter_index.positions(score, continents)]))
+
+
+def continent_plot():
+    return FigureRequest(static_figures, 'continent_plot',
+                         lambda: build_continent_plot(group_stats.box_stats('Continent')))
+
+
+def region_plot(min_score, continents, regions):
+    score = filter_index.snap_min_score(min_score)
+    continents = tuple(sorted(continents))
+    regions = tuple(sorted(regions))
+    # The annotations of the plot only line up with the boxes when every region is shown
+    show_the_west = (set(continents) == set(filter_index.continent_masks)
+                     and set(regions) == set(filter_index.regions_of(continents)))
+    return FigureRequest(filtered_figures, ('region_plot', score, continents, regions, show_the_west),
+                         lambda: build_region_plot(group_stats.box_stats('Region', score, continents, regions),
+                                                   show_the_west))
+
+
+def top_countries_plot():
+    return FigureRequest(static_figures, 'top_countries_plot',
+                         lambda: build_top_countries_plot(group_stats.ranking(5)))
+
+
+def indicators_plot(metrics, method, render_mode, max_points=DOWNSAMPLE_THRESHOLD):
+    metrics = tuple(metrics)
+    # Only the down-sampled grid depends on the number of points, the other modes share one entry for every value
+    options = {'max_points': max_points} if render_mode == 'webgl-downsampled' else {}
+    return FigureRequest(filtered_figures, ('indicators_plot', metrics, method, render_mode, *options.values()),
+                         lambda: build_indicators_plot(full_data, list(metrics),
+                                                       correlations(full_data, dataset_version, method),
+                                                       render_mode, **options))
+
+
+# The history is stored apart from the dataset, its figures are keyed by the years they show
+def happiness_history_plot(years):
+    years = tuple(years)
+    return FigureRequest(static_figures, ('happiness_history_plot', years),
+                         lambda: build_happiness_history_plot(load_history(years)))
+
+
+def happiness_trend_plot(years, countries):
+    years = tuple(years)
+    countries = tuple(sorted(countries))
+    return FigureRequest(filtered_figures, ('happiness_trend_plot', years, countries),
+                         lambda: build_happiness_trend_plot(load_history(years), list(countries)))
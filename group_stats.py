@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+import profiling
+
+# Whiskers reach the furthest score within this many interquartile ranges of the box, like in plotly.js
+FENCE_IQR = 1.5
+
+
+def interpolate(sorted_scores, fraction):
+    """The fraction quantile of sorted scores, interpolated between ranks like plotly.js does for its boxes."""
+    position = fraction * len(sorted_scores) - 0.5
+    if position < 0:
+        return sorted_scores[0]
+    if position > len(sorted_scores) - 1:
+        return sorted_scores[-1]
+    low = int(np.floor(position))
+    high = int(np.ceil(position))
+    weight = position - low
+    return weight * sorted_scores[high] + (1 - weight) * sorted_scores[low]
+
+
+class GroupStats:
+    """Happiness scores of every (continent, region) cell of the dataset, sorted once when the dataset is loaded.
+
+    Charts that summarize groups of countries (box plots, rankings) merge the sorted scores of the selected cells
+    instead of grouping the rows on every rerun. The box statistics match the ones plotly.js computes from the
+    points, so the charts only send five numbers and the outliers per box.
+    """
+
+    def __init__(self, data):
+        self.names = data['Country name'].to_numpy()
+        self.scores = scores = data['Happiness Score'].to_numpy(dtype=np.float64)
+        continent_codes, continents = pd.factorize(data['Continent'])
+        region_codes, regions = pd.factorize(data['Region'])
+
+        # Rows ordered by cell and score, lexsort is stable so equal scores stay in data order
+        cell_codes = continent_codes * len(regions) + region_codes
+        order = np.lexsort((scores, cell_codes))
+        boundaries = np.flatnonzero(np.diff(cell_codes[order])) + 1
+        self.cells = {}
+        for rows in np.split(order, boundaries):
+            if len(rows):
+                cell = (continents[continent_codes[rows[0]]], regions[region_codes[rows[0]]])
+                self.cells[cell] = (scores[rows], rows)
+
+    def select(self, min_score=None, continents=None, regions=None):
+        """Scores and row positions of every selected cell, above min_score and sorted by score."""
+        selected = {}
+        for (continent, region), (scores, rows) in self.cells.items():
+            if (continents is not None and continent not in continents) or (regions is not None
+                                                                            and region not in regions):
+                continue
+            start = 0 if min_score is None else np.searchsorted(scores, min_score, side='right')
+            if start < len(scores):
+                selected[continent, region] = (scores[start:], rows[start:])
+        return selected
+
+    def box_stats(self, by, min_score=None, continents=None, regions=None):
+        """Box plot statistics of the selected countries per 'Continent' or 'Region', by descending median.
+
+        Columns are count, q1, median, q3, lowerfence and upperfence, and the scores and country names of the outliers
+        beyond the fences.
+        """
+        with profiling.span('group stats'):
+            level = 0 if by == 'Continent' else 1
+            groups = {}
+            for cell, cell_scores in self.select(min_score, continents, regions).items():
+                groups.setdefault(cell[level], []).append(cell_scores)
+
+            stats = {}
+            for group, parts in groups.items():
+                scores = np.concatenate([scores for scores, _ in parts])
+                rows = np.concatenate([rows for _, rows in parts])
+                order = np.argsort(scores, kind='stable')
+                scores, rows = scores[order], rows[order]
+
+                q1, median, q3 = (interpolate(scores, fraction) for fraction in (0.25, 0.5, 0.75))
+                fence = FENCE_IQR * (q3 - q1)
+                lowerfence = min(q1, scores[min(np.searchsorted(scores, q1 - fence, side='left'), len(scores) - 1)])
+                upperfence = max(q3, scores[max(np.searchsorted(scores, q3 + fence, side='right') - 1, 0)])
+                outliers = (scores < lowerfence) | (scores > upperfence)
+                stats[group] = {'count': len(scores), 'q1': q1, 'median': median, 'q3': q3,
+                                'lowerfence': lowerfence, 'upperfence': upperfence,
+                                'outlier_scores': scores[outliers], 'outlier_names': self.names[rows[outliers]]}
+
+            columns = ['count', 'q1', 'median', 'q3', 'lowerfence', 'upperfence', 'outlier_scores', 'outlier_names']
+            box_stats = pd.DataFrame.from_dict(stats, orient='index', columns=columns).sort_index()
+            return box_stats.sort_values('median', ascending=False, kind='stable')
+
+    def ranking_rows(self, n):
+        """Row positions of the n happiest countries, happiest first, and of the n unhappiest, unhappiest first.
+
+        Only the n highest and lowest scores of every cell can make it, ties are ranked by their order in the data
+        like Series.nlargest and Series.nsmallest do.
+        """
+        top, bottom = [], []
+        for scores, rows in self.cells.values():
+            # Scores tied with the n-th one are kept as well, an earlier row may win the tie over a later one
+            start = np.searchsorted(scores, scores[max(len(scores) - n, 0)], side='left')
+            end = np.searchsorted(scores, scores[min(n, len(scores)) - 1], side='right')
+            top.append((scores[start:], rows[start:]))
+            bottom.append((scores[:end], rows[:end]))
+
+        def extremes(parts, largest):
+            scores = np.concatenate([scores for scores, _ in parts])
+            rows = np.concatenate([rows for _, rows in parts])
+            return rows[np.lexsort((rows, -scores if largest else scores))[:n]]
+
+        return extremes(top, True), extremes(bottom, False)
+
+    def ranking(self, n):
+        """Scores of the n happiest and the n unhappiest countries, indexed by country name, see ranking_rows."""
+        rows = np.concatenate(self.ranking_rows(n))
+        return pd.Series(self.scores[rows], index=pd.Index(self.names[rows], name='Country name'),
+                         name='Happiness Score')
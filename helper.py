@@ -1,5 +1,27 @@
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import NamedTuple
+
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+import profiling
+from column_stats import StatsStore
+from group_stats import GroupStats
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+SNAPSHOT_DIR = os.path.join(DATA_DIR, 'snapshot')
+
+# Bump this whenever the cleaning in build_full_data changes, so old snapshots are not reused
+SNAPSHOT_VERSION = 6
 
 continent_color_map = {
     'Europe': '#1f77b4',
@@ -31,105 +53,610 @@ region_color_map = {
     'Sub-Saharan Africa': '#9467bd',
 }
 
-# Import data
-whr23 = pd.read_csv('data/WHR2023.csv')
-world_data = pd.read_csv('data/world-data-2023.csv')
-continent_file = pd.read_csv('data/continents2.csv')
-
-# Data cleaning
-
-# Merge the datasets
-# Change column names to match the main dataset
-continent_file.rename(columns={'name': 'Country name', 'alpha-2': 'country code'}, inplace=True)
-column_order = ['Country name', 'region', 'sub-region', 'country code']
-
-# Renaming countries to match the main dataset
-whr23.loc[whr23['Country name'] == 'Congo (Kinshasa)', 'Country name'] = 'Congo (Democratic Republic Of The)'
-whr23.loc[whr23['Country name'] == 'Congo (Brazzaville)', 'Country name'] = 'Congo'
-whr23.loc[whr23['Country name'] == 'Turkiye', 'Country name'] = 'Turkey'
-whr23.loc[whr23['Country name'] == 'Czechia', 'Country name'] = 'Czech Republic'
-whr23.loc[whr23['Country name'] == 'Taiwan Province of China', 'Country name'] = 'Taiwan'
-whr23.loc[whr23['Country name'] == 'Bosnia and Herzegovina', 'Country name'] = 'Bosnia And Herzegovina'
-whr23.loc[whr23['Country name'] == 'Hong Kong S.A.R. of China', 'Country name'] = 'Hong Kong'
-whr23.loc[whr23['Country name'] == 'North Macedonia', 'Country name'] = 'Macedonia'
-whr23.loc[whr23['Country name'] == 'State of Palestine', 'Country name'] = 'Palestine, State of'
-whr23.loc[whr23['Country name'] == 'Ivory Coast', 'Country name'] = 'Côte D\'Ivoire'
-
-# Merge region and sub-region into whr23score after country name
-merged_data = whr23.merge(continent_file[['Country name', 'region', 'sub-region', 'country code']], on='Country name')
-column_order = ['Country name', 'region', 'sub-region', 'country code'] + [col for col in merged_data.columns if
-                                                                           col not in column_order]
-merged_data = merged_data[column_order]
-
-# Rename the 'Country' column to 'Country name' in the extra_data DataFrame
-world_data.rename(columns={'Country': 'Country name'}, inplace=True)
-
-# Change names of countries to match the main dataset
-merged_data.loc[merged_data['Country name'] == 'Ireland', 'Country name'] = 'Republic of Ireland'
-merged_data.loc[merged_data['Country name'] == 'Bosnia And Herzegovina', 'Country name'] = 'Bosnia and Herzegovina'
-merged_data.loc[merged_data['Country name'] == 'Congo', 'Country name'] = 'Republic of the Congo'
-merged_data.loc[merged_data[
-                    'Country name'] == 'Congo (Democratic Republic Of The)', 'Country name'] = 'Democratic Republic of the Congo'
-merged_data.loc[merged_data['Country name'] == 'Macedonia', 'Country name'] = 'North Macedonia'
-merged_data.loc[merged_data['Country name'] == 'Côte D\'Ivoire', 'Country name'] = 'Ivory Coast'
-merged_data.loc[merged_data['Country name'] == 'Palestine, State of', 'Country name'] = 'Palestinian National Authority'
-merged_data.loc[merged_data['Country name'] == 'Gambia', 'Country name'] = 'The Gambia'
-
-# Merge the data for your own new dataset
-full_data = merged_data.merge(
-    world_data,
-    on='Country name')
-
-# rename columns
-full_data['Continent'] = full_data['region']
-full_data['Region'] = full_data['sub-region']
-full_data['Happiness Score'] = full_data['Ladder score']
-full_data['Density'] = full_data['Density\n(P/Km2)']
-full_data['Land Area'] = full_data['Land Area(Km2)']
-full_data['Forested Area'] = full_data['Forested Area (%)']
-full_data['CPI Change'] = full_data['CPI Change (%)']
-full_data['Tax revenue'] = full_data['Tax revenue (%)']
-full_data['Urban population'] = full_data['Urban_population']
-full_data['Agricultural Land'] = full_data['Agricultural Land( %)']
-full_data['Primary education enrollment'] = full_data['Gross primary education enrollment (%)']
-full_data['Tertiary education enrollment'] = full_data['Gross tertiary education enrollment (%)']
-full_data['Labor force participation'] = full_data['Population: Labor force participation (%)']
-
-full_data.drop(['region', 'sub-region', 'Ladder score', 'Density\n(P/Km2)', 'Land Area(Km2)', 'Forested Area (%)',
-                'CPI Change (%)', 'Tax revenue (%)', 'Urban_population', 'Agricultural Land( %)',
-                'Gross tertiary education enrollment (%)', 'Gross primary education enrollment (%)',
-                'Population: Labor force participation (%)', ], axis=1, inplace=True)
-
-# drop useless columns
-full_data.drop(
-    ['country code', 'Standard error of ladder score', 'upperwhisker', 'lowerwhisker', 'Ladder score in Dystopia',
-     'Explained by: Log GDP per capita', 'Explained by: Social support', 'Explained by: Healthy life expectancy',
-     'Explained by: Freedom to make life choices', 'Explained by: Generosity',
-     'Explained by: Perceptions of corruption', 'Dystopia + residual', 'Abbreviation', 'Official language',
-     'Largest city', 'Capital/Major City', 'Currency-Code', 'Calling Code', 'Latitude', 'Longitude', 'Fertility Rate'],
-    axis=1, inplace=True)
-
-# Remove commas from all string columns
-full_data = full_data.apply(lambda x: x.str.replace(',', '') if x.dtype == 'object' else x)
-full_data = full_data.apply(lambda x: x.str.replace('$', '') if x.dtype == 'object' else x)
-full_data = full_data.apply(lambda x: x.str.replace('%', '') if x.dtype == 'object' else x)
-full_data = full_data.apply(lambda x: x.str.strip() if x.dtype == 'object' else x)
-
-number_cols = ['Logged GDP per capita', 'Social support', 'Healthy life expectancy', 'Freedom to make life choices',
-               'Generosity', 'Perceptions of corruption', 'Armed Forces size', 'Birth Rate', 'Co2-Emissions', 'CPI',
-               'Gasoline Price', 'GDP', 'Infant mortality', 'Life expectancy', 'Maternal mortality ratio',
-               'Minimum wage', 'Out of pocket health expenditure', 'Physicians per thousand', 'Population',
-               'Total tax rate', 'Unemployment rate', 'Happiness Score', 'Density', 'Land Area', 'Forested Area',
-               'CPI Change', 'Tax revenue', 'Agricultural Land', 'Primary education enrollment',
-               'Tertiary education enrollment', 'Labor force participation', 'Urban population']
-
-full_data[number_cols] = full_data[number_cols].apply(pd.to_numeric, errors='coerce')
-
-# Now let's add our own math an calculate the percentage living in an urban area
-full_data['Urban population percentage'] = (full_data['Urban population'] / full_data['Population']) * 100
-full_data['Co2-Emissions per capita'] = full_data['Co2-Emissions'] / full_data['Population']
-full_data['Armed Forces percentage of Population'] = full_data['Armed Forces size'] / full_data['Population'] * 100
-
-# Replace NaN values with the respective column mean
-numeric_means = full_data.select_dtypes(include=[np.number, None]).mean()
-full_data.update(full_data.select_dtypes(include=[np.number]).fillna(numeric_means))
+
+# Characters that are stripped from the raw text of a column before parsing, by unit of the column
+UNIT_PATTERNS = {
+    'number': r'\s',
+    'count': r'[,\s]',
+    'currency': r'[$,\s]',
+    'percent': r'[%,\s]',
+}
+
+# Unit and target dtype of every numeric column of the cleaned dataset
+COLUMN_SCHEMA = {
+    'Logged GDP per capita': ('number', 'float64'),
+    'Social support': ('number', 'float64'),
+    'Healthy life expectancy': ('number', 'float64'),
+    'Freedom to make life choices': ('number', 'float64'),
+    'Generosity': ('number', 'float64'),
+    'Perceptions of corruption': ('number', 'float64'),
+    'Armed Forces size': ('count', 'float64'),
+    'Birth Rate': ('number', 'float64'),
+    'Co2-Emissions': ('count', 'float64'),
+    'CPI': ('count', 'float64'),
+    'Gasoline Price': ('currency', 'float64'),
+    'GDP': ('currency', 'float64'),
+    'Infant mortality': ('number', 'float64'),
+    'Life expectancy': ('number', 'float64'),
+    'Maternal mortality ratio': ('number', 'float64'),
+    'Minimum wage': ('currency', 'float64'),
+    'Out of pocket health expenditure': ('percent', 'float64'),
+    'Physicians per thousand': ('number', 'float64'),
+    'Population': ('count', 'float64'),
+    'Total tax rate': ('percent', 'float64'),
+    'Unemployment rate': ('percent', 'float64'),
+    'Happiness Score': ('number', 'float64'),
+    'Density': ('count', 'float64'),
+    'Land Area': ('count', 'float64'),
+    'Forested Area': ('percent', 'float64'),
+    'CPI Change': ('percent', 'float64'),
+    'Tax revenue': ('percent', 'float64'),
+    'Agricultural Land': ('percent', 'float64'),
+    'Primary education enrollment': ('percent', 'float64'),
+    'Tertiary education enrollment': ('percent', 'float64'),
+    'Labor force participation': ('percent', 'float64'),
+    'Urban population': ('count', 'float64'),
+}
+
+
+def parse_columns(data, schema):
+    """Parse the columns of the schema in place and return how many cells of each column were coerced to NaN."""
+    coerced_to_nan = {}
+    for column, (unit, dtype) in schema.items():
+        values = data[column]
+        if values.dtype == object:
+            present = values.notna()
+            values = pd.to_numeric(values.str.replace(UNIT_PATTERNS[unit], '', regex=True), errors='coerce')
+            coerced_to_nan[column] = int((present & values.isna()).sum())
+        else:
+            coerced_to_nan[column] = 0
+        data[column] = values.astype(dtype)
+    return coerced_to_nan
+
+
+# Names used by the datasets that differ from continents2.csv, mapped to their ISO 3166 alpha-3 code
+COUNTRY_ALIASES = {
+    'Bosnia and Herzegovina': 'BIH',
+    'Brunei': 'BRN',
+    'Cape Verde': 'CPV',
+    'Congo (Brazzaville)': 'COG',
+    'Congo (Kinshasa)': 'COD',
+    'Czechia': 'CZE',
+    'Democratic Republic of the Congo': 'COD',
+    'East Timor': 'TLS',
+    'Federated States of Micronesia': 'FSM',
+    'Guinea-Bissau': 'GNB',
+    'Hong Kong S.A.R. of China': 'HKG',
+    'Ivory Coast': 'CIV',
+    'North Korea': 'PRK',
+    'North Macedonia': 'MKD',
+    'Palestinian National Authority': 'PSE',
+    'Republic of Ireland': 'IRL',
+    'Republic of the Congo': 'COG',
+    # continents2.csv lists South Korea with the codes of North Korea
+    'South Korea': 'KOR',
+    'State of Palestine': 'PSE',
+    'Taiwan Province of China': 'TWN',
+    'The Bahamas': 'BHS',
+    'The Gambia': 'GMB',
+    'Turkiye': 'TUR',
+    'Vatican City': 'VAT',
+}
+
+
+def build_country_index(continent_file):
+    """Map every known country name, including the aliases, onto its numeric ISO 3166 code."""
+    codes = continent_file.set_index('alpha-3')['country-code']
+    names = pd.Series(continent_file['country-code'].values, index=continent_file['name'])
+    aliases = pd.Series(COUNTRY_ALIASES).map(codes)
+    country_index = pd.concat([names, aliases])
+    # Aliases win over the names of continents2.csv
+    return country_index[~country_index.index.duplicated(keep='last')]
+
+
+def add_country_key(data, name_column, country_index):
+    """Add the 'country-code' key to data and return it together with the country names that could not be mapped."""
+    keys = data[name_column].map(country_index)
+    unmatched = data.loc[keys.isna(), name_column].tolist()
+    data = data[keys.notna()].assign(**{'country-code': keys[keys.notna()].astype('int64')})
+    return data, unmatched
+
+
+class Source(NamedTuple):
+    """A CSV input of the pipeline: its file, text format and the dtype of every column that is read.
+
+    Other columns of the file are skipped, a file without one of the columns is rejected before it is parsed.
+    """
+    file: str
+    columns: dict
+    encoding: str = 'utf-8'
+    separator: str = ','
+
+
+# Raw CSV inputs of the pipeline, by the name build_full_data uses for them. Columns with unit formatting are read as
+# text and parsed by parse_columns.
+SOURCES = {
+    'whr23': Source('WHR2023.csv', {
+        'Country name': str,
+        'Ladder score': 'float64',
+        'Logged GDP per capita': 'float64',
+        'Social support': 'float64',
+        'Healthy life expectancy': 'float64',
+        'Freedom to make life choices': 'float64',
+        'Generosity': 'float64',
+        'Perceptions of corruption': 'float64',
+    }),
+    'world_data': Source('world-data-2023.csv', {
+        'Country': str,
+        'Density\n(P/Km2)': str,
+        'Agricultural Land( %)': str,
+        'Land Area(Km2)': str,
+        'Armed Forces size': str,
+        'Birth Rate': 'float64',
+        'Co2-Emissions': str,
+        'CPI': str,
+        'CPI Change (%)': str,
+        'Forested Area (%)': str,
+        'Gasoline Price': str,
+        'GDP': str,
+        'Gross primary education enrollment (%)': str,
+        'Gross tertiary education enrollment (%)': str,
+        'Infant mortality': 'float64',
+        'Life expectancy': 'float64',
+        'Maternal mortality ratio': 'float64',
+        'Minimum wage': str,
+        'Out of pocket health expenditure': str,
+        'Physicians per thousand': 'float64',
+        'Population': str,
+        'Population: Labor force participation (%)': str,
+        'Tax revenue (%)': str,
+        'Total tax rate': str,
+        'Unemployment rate': str,
+        'Urban_population': str,
+    }),
+    # Exported with a byte order mark
+    'continent_file': Source('continents2.csv', {
+        'name': str,
+        'alpha-3': str,
+        'country-code': 'int64',
+        'region': str,
+        'sub-region': str,
+    }, encoding='utf-8-sig'),
+}
+
+SOURCE_FILES = {name: source.file for name, source in SOURCES.items()}
+
+# Columns of the sources that get a new name in the cleaned dataset, in the order they are added
+RENAMED_COLUMNS = {
+    'region': 'Continent',
+    'sub-region': 'Region',
+    'Ladder score': 'Happiness Score',
+    'Density\n(P/Km2)': 'Density',
+    'Land Area(Km2)': 'Land Area',
+    'Forested Area (%)': 'Forested Area',
+    'CPI Change (%)': 'CPI Change',
+    'Tax revenue (%)': 'Tax revenue',
+    'Urban_population': 'Urban population',
+    'Agricultural Land( %)': 'Agricultural Land',
+    'Gross primary education enrollment (%)': 'Primary education enrollment',
+    'Gross tertiary education enrollment (%)': 'Tertiary education enrollment',
+    'Population: Labor force participation (%)': 'Labor force participation',
+}
+
+# Above this size the world data is ingested in chunks instead of being read at once
+CHUNKED_INGEST_BYTES = 256 * 1024 * 1024
+
+# Rows of the world data per chunk when it is ingested in chunks
+CHUNK_ROWS = 100_000
+
+HASH_BLOCK_BYTES = 1024 * 1024
+
+# How missing values are filled in, one of column_stats.IMPUTE_STRATEGIES
+IMPUTE_STRATEGY = 'mean'
+
+
+def check_header(path, source):
+    """Raise ValueError if the header of the file at path lacks one of the columns of the source."""
+    header = pd.read_csv(path, sep=source.separator, encoding=source.encoding, nrows=0).columns
+    missing = [column for column in source.columns if column not in header]
+    if missing:
+        raise ValueError(f'{source.file} is missing the columns {", ".join(map(repr, missing))}')
+
+
+def read_source(path, source):
+    """Read the declared columns of a source file with their dtypes, raising ValueError if the file does not match."""
+    check_header(path, source)
+    try:
+        return pd.read_csv(path, sep=source.separator, encoding=source.encoding, usecols=list(source.columns),
+                           dtype=source.columns)
+    except (ValueError, UnicodeDecodeError) as error:
+        raise ValueError(f'{source.file} does not match its schema: {error}') from error
+
+
+def read_sources(data_dir=DATA_DIR):
+    """Read and validate the raw CSV inputs of the pipeline, concurrently."""
+    with ThreadPoolExecutor(max_workers=len(SOURCES)) as pool:
+        futures = {name: pool.submit(read_source, os.path.join(data_dir, source.file), source)
+                   for name, source in SOURCES.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+@contextmanager
+def timed(timings, stage):
+    """Add the run time of the block to timings[stage], if timings are collected."""
+    start = time.perf_counter()
+    yield
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def join_world_data(surveyed, world_data):
+    """Merge the world data onto the surveyed countries, on their numeric ISO 3166 code."""
+    full_data = surveyed.merge(world_data, on='country-code')
+
+    # Keep the country names of the world dataset, and the ISO 3166 alpha-3 code the map is keyed by
+    full_data['Country name'] = full_data.pop('Country')
+    full_data['Country code'] = full_data.pop('alpha-3')
+    column_order = ['Country name', 'Country code'] + [col for col in full_data.columns
+                                                       if col not in ('Country name', 'Country code', 'country-code')]
+    return full_data[column_order]
+
+
+def clean_columns(full_data, timings=None):
+    """Rename, clean and parse the columns of the merged data in place and add the derived columns.
+
+    Returns how many cells of each column were coerced to NaN, see parse_columns.
+    """
+    # rename columns
+    with timed(timings, 'rename'):
+        for source, target in RENAMED_COLUMNS.items():
+            full_data[target] = full_data[source]
+        full_data.drop(list(RENAMED_COLUMNS), axis=1, inplace=True)
+
+    with timed(timings, 'clean'):
+        full_data['Country name'] = full_data['Country name'].str.strip()
+
+    # Strip the unit formatting and parse every numeric column in a single pass
+    with timed(timings, 'coerce'):
+        coerced_to_nan = parse_columns(full_data, COLUMN_SCHEMA)
+
+        # Now let's add our own math an calculate the percentage living in an urban area
+        full_data['Urban population percentage'] = (full_data['Urban population'] / full_data['Population']) * 100
+        full_data['Co2-Emissions per capita'] = full_data['Co2-Emissions'] / full_data['Population']
+        full_data['Armed Forces percentage of Population'] = (full_data['Armed Forces size']
+                                                              / full_data['Population'] * 100)
+    return coerced_to_nan
+
+
+def build_full_data(data_dir=DATA_DIR, timings=None, impute=IMPUTE_STRATEGY):
+    """Run the full CSV cleaning pipeline on the CSV files in data_dir and return the cleaned dataset.
+
+    Missing values are filled with the impute strategy, see column_stats.IMPUTE_STRATEGIES. If timings is a dict,
+    the seconds spent in every stage of the pipeline (read, merge, rename, clean, coerce, impute) are added to it.
+    """
+    # Import data
+    with timed(timings, 'read'):
+        sources = read_sources(data_dir)
+        whr23, world_data, continent_file = sources['whr23'], sources['world_data'], sources['continent_file']
+
+    # Data cleaning
+
+    with timed(timings, 'merge'):
+        # Map the country names of every source onto their numeric ISO 3166 code and merge on that code
+        country_index = build_country_index(continent_file)
+        whr23, whr23_unmatched = add_country_key(whr23, 'Country name', country_index)
+        world_data, world_data_unmatched = add_country_key(world_data, 'Country', country_index)
+
+        # Merge region and sub-region into whr23score, then the data for your own new dataset
+        surveyed = whr23.merge(continent_file[['country-code', 'alpha-3', 'region', 'sub-region']], on='country-code')
+        full_data = join_world_data(surveyed, world_data)
+
+        full_data.attrs['unmatched_countries'] = {
+            'WHR2023.csv': whr23_unmatched,
+            'world-data-2023.csv': world_data_unmatched,
+            # Surveyed countries that are missing from the world dataset
+            'merge': whr23.loc[~whr23['country-code'].isin(world_data['country-code']), 'Country name'].tolist(),
+        }
+
+    full_data.attrs['coerced_to_nan'] = clean_columns(full_data, timings)
+
+    with timed(timings, 'impute'):
+        # Replace NaN values with the respective column mean (or the statistic of the impute strategy)
+        stats = StatsStore(full_data.select_dtypes(include=[np.number]).columns, 'Continent')
+        stats.append(full_data)
+        stats.impute(full_data, impute)
+        full_data.attrs['column_stats'] = stats.summary().to_dict('index')
+
+    return full_data
+
+
+def ingest_chunked(path, data_dir=DATA_DIR, chunk_rows=CHUNK_ROWS, timings=None, impute=IMPUTE_STRATEGY):
+    """Run the cleaning pipeline chunk by chunk and write the cleaned dataset to a Feather file at path.
+
+    The world data is read chunk_rows rows at a time, as text with the unused columns skipped, and every chunk is
+    joined against the surveyed countries and the country index, which stay in memory. The cleaned chunks are
+    streamed into a temporary Arrow file while their running statistics are accumulated, a second pass over that
+    file fills in the missing values. Memory use depends on chunk_rows, not the input size.
+    The result matches build_full_data, with its rows ordered by chunk.
+    """
+    with timed(timings, 'read'):
+        whr23 = read_source(os.path.join(data_dir, SOURCE_FILES['whr23']), SOURCES['whr23'])
+        continent_file = read_source(os.path.join(data_dir, SOURCE_FILES['continent_file']), SOURCES['continent_file'])
+
+    with timed(timings, 'merge'):
+        country_index = build_country_index(continent_file)
+        whr23, whr23_unmatched = add_country_key(whr23, 'Country name', country_index)
+        surveyed = whr23.merge(continent_file[['country-code', 'alpha-3', 'region', 'sub-region']], on='country-code')
+
+    world_data = SOURCES['world_data']
+    world_data_path = os.path.join(data_dir, world_data.file)
+    check_header(world_data_path, world_data)
+    # With the declared dtypes every chunk gets the same dtypes, whatever values it happens to contain
+    chunks = iter(pd.read_csv(world_data_path, sep=world_data.separator, encoding=world_data.encoding,
+                              usecols=list(world_data.columns), dtype=world_data.columns, chunksize=chunk_rows))
+
+    world_data_unmatched = {}
+    matched_codes = set()
+    coerced_to_nan = dict.fromkeys(COLUMN_SCHEMA, 0)
+    stats = None
+    schema = None
+    tmp_path = f'{path}.{os.getpid()}.chunks.tmp'
+    writer = None
+    try:
+        while True:
+            with timed(timings, 'read'):
+                try:
+                    chunk = next(chunks, None)
+                except (ValueError, UnicodeDecodeError) as error:
+                    raise ValueError(f'{world_data.file} does not match its schema: {error}') from error
+            if chunk is None:
+                break
+
+            with timed(timings, 'merge'):
+                chunk, unmatched = add_country_key(chunk, 'Country', country_index)
+                world_data_unmatched.update(dict.fromkeys(unmatched))
+                matched_codes.update(chunk['country-code'].unique().tolist())
+                chunk = join_world_data(surveyed, chunk)
+
+            for column, count in clean_columns(chunk, timings).items():
+                coerced_to_nan[column] += count
+
+            with timed(timings, 'impute'):
+                if stats is None:
+                    stats = StatsStore(chunk.select_dtypes(include=[np.number]).columns, 'Continent')
+                stats.append(chunk)
+
+            with timed(timings, 'write'):
+                table = pa.Table.from_pandas(chunk.reset_index(drop=True), preserve_index=False)
+                if writer is None:
+                    schema = table.schema
+                    writer = pa.ipc.new_file(tmp_path, schema)
+                writer.write_table(table.cast(schema))
+        if writer is None:
+            raise ValueError(f'No rows of {SOURCE_FILES["world_data"]} could be matched to a surveyed country')
+        writer.close()
+        writer = None
+
+        attrs = {
+            'unmatched_countries': {
+                'WHR2023.csv': whr23_unmatched,
+                'world-data-2023.csv': list(world_data_unmatched),
+                'merge': whr23.loc[~whr23['country-code'].isin(matched_codes), 'Country name'].tolist(),
+            },
+            'coerced_to_nan': coerced_to_nan,
+            'column_stats': stats.summary().to_dict('index'),
+        }
+        with timed(timings, 'impute'):
+            fill_chunks(tmp_path, path, stats, impute, attrs)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def fill_chunks(chunks_path, path, stats, impute, attrs):
+    """Copy the record batches of an Arrow file to a Feather file at path, with the missing values imputed."""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with pa.OSFile(chunks_path) as source:
+        reader = pa.ipc.open_file(source)
+        metadata = {**(reader.schema.metadata or {}), b'helper.attrs': json.dumps(attrs).encode()}
+        schema = reader.schema.with_metadata(metadata)
+        with pa.ipc.new_file(tmp_path, schema) as writer:
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i).to_pandas()
+                stats.impute(batch, impute)
+                writer.write_batch(pa.RecordBatch.from_pandas(batch, schema=schema, preserve_index=False))
+    os.replace(tmp_path, path)
+
+
+def data_hash(impute=IMPUTE_STRATEGY):
+    """Hash the raw CSV inputs, the snapshot version and the impute strategy to identify a dataset version."""
+    digest = hashlib.sha256(f'v{SNAPSHOT_VERSION}-{impute}'.encode())
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, '*.csv'))):
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            # In blocks, so large inputs are never held in memory at once
+            for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b''):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def snapshot_path(version):
+    return os.path.join(SNAPSHOT_DIR, f'full_data-{version}.feather')
+
+
+def read_snapshot(path):
+    # The snapshot is uncompressed, so the mapped columns are read straight from the OS page cache without being
+    # decompressed or parsed. to_pandas copies them into the DataFrame, workers do not share its memory.
+    table = feather.read_table(path, memory_map=True)
+    data = table.to_pandas()
+    data.attrs.update(json.loads(table.schema.metadata.get(b'helper.attrs', b'{}')))
+    return data
+
+
+def write_snapshot(data, version):
+    """Write the cleaned dataset to a Feather snapshot and remove snapshots of older dataset versions."""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = snapshot_path(version)
+    # Write to a temporary file first, so other workers never map a half written snapshot
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    table = pa.Table.from_pandas(data.reset_index(drop=True), preserve_index=False)
+    # Arrow does not keep DataFrame.attrs, so they are stored in the schema metadata
+    metadata = {**(table.schema.metadata or {}), b'helper.attrs': json.dumps(data.attrs).encode()}
+    # Uncompressed like the snapshots of fill_chunks, Feather compresses with lz4 by default
+    feather.write_feather(table.replace_schema_metadata(metadata), tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+    remove_old_snapshots(path)
+    return path
+
+
+def write_snapshot_chunked(version, timings=None):
+    """Like write_snapshot, but the snapshot is built from the CSV files chunk by chunk, see ingest_chunked."""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = ingest_chunked(snapshot_path(version), timings=timings)
+    remove_old_snapshots(path)
+    return path
+
+
+def remove_old_snapshots(path):
+    for old_path in glob.glob(os.path.join(SNAPSHOT_DIR, 'full_data-*.feather')):
+        if old_path != path:
+            os.remove(old_path)
+
+
+def needs_chunked_ingest(data_dir=DATA_DIR):
+    return os.path.getsize(os.path.join(data_dir, SOURCE_FILES['world_data'])) > CHUNKED_INGEST_BYTES
+
+
+def load_full_data(timings=None):
+    """Load the cleaned dataset from the snapshot, falling back to the CSV pipeline if it is missing or stale.
+
+    If timings is a dict, the seconds spent in every step are added to it, see build_full_data.
+    """
+    with timed(timings, 'hash'):
+        version = data_hash()
+    path = snapshot_path(version)
+    if os.path.exists(path):
+        with timed(timings, 'snapshot'):
+            return read_snapshot(path), version
+
+    if needs_chunked_ingest():
+        # Too large to clean in memory, the chunks are cleaned into the snapshot and only the result is loaded
+        path = write_snapshot_chunked(version, timings)
+        with timed(timings, 'snapshot'):
+            return read_snapshot(path), version
+
+    data = build_full_data(timings=timings)
+    try:
+        with timed(timings, 'write snapshot'):
+            write_snapshot(data, version)
+    except OSError:
+        # Read-only deployments still work, they just pay for the full pipeline on every start
+        pass
+    return data, version
+
+
+class FilterIndex:
+    """Precomputed masks for the region and score filters, shared by every chart on the page.
+
+    Continents and sub-regions are encoded as category codes with a boolean mask over the rows for every category,
+    and the rows are sorted by happiness score.
+    A filter ORs the masks of the selected categories, ANDs continents with sub-regions and finds the score
+    threshold with a binary search. It returns row positions, the data is only copied by the caller that needs it.
+    """
+
+    def __init__(self, data):
+        self.size = len(data)
+        self.continent_masks = self._category_masks(data['Continent'])
+        self.region_masks = self._category_masks(data['Region'])
+        self.continent_regions = {continent: [region for region, mask in self.region_masks.items()
+                                              if (mask & continent_mask).any()]
+                                  for continent, continent_mask in self.continent_masks.items()}
+        self.first_rows = {category: mask.argmax()
+                           for masks in (self.continent_masks, self.region_masks) for category, mask in masks.items()}
+
+        scores = data['Happiness Score'].to_numpy()
+        self.score_order = np.argsort(scores, kind='stable')
+        self.sorted_scores = scores[self.score_order]
+        # Sorted distinct happiness scores, the only thresholds at which the filtered countries change
+        self.distinct_scores = np.unique(scores)
+
+    @staticmethod
+    def _category_masks(column):
+        # Masks of the categories that occur, in the order of their first row
+        codes, categories = pd.factorize(column)
+        return {category: codes == code for code, category in enumerate(categories)}
+
+    def regions_of(self, continents):
+        """Sub-regions of the given continents, in the order of their first row."""
+        regions = {region for continent in continents for region in self.continent_regions[continent]}
+        return sorted(regions, key=self.first_rows.get)
+
+    def snap_min_score(self, min_score):
+        """Snap a minimum score down to the highest distinct happiness score not above it.
+
+        Every threshold between two distinct scores selects the same countries, so the snapped value can be used as
+        a cache key for filtered data.
+        """
+        position = np.searchsorted(self.distinct_scores, min_score, side='right')
+        return float(self.distinct_scores[position - 1]) if position else float('-inf')
+
+    def positions(self, min_score, continents, regions=None):
+        """Row positions, in data order, of the countries above min_score in the continents (and sub-regions)."""
+        with profiling.span('filter'):
+            mask = self._any(self.continent_masks, continents)
+            if regions is not None:
+                mask &= self._any(self.region_masks, regions)
+
+            above = self.score_order[np.searchsorted(self.sorted_scores, min_score, side='right'):]
+            return np.sort(above[mask[above]])
+
+    def _any(self, masks, categories):
+        mask = np.zeros(self.size, dtype=bool)
+        for category in categories:
+            if category in masks:
+                mask |= masks[category]
+        return mask
+
+
+# Seconds spent loading the dataset when this process started, shown in the debug panel of the app
+load_timings = {}
+# The build step below builds the snapshot itself, loading the dataset first would build and write it a second time
+# on a cold directory
+if __name__ != '__main__':
+    full_data, dataset_version = load_full_data(load_timings)
+    with timed(load_timings, 'filter index'):
+        filter_index = FilterIndex(full_data)
+    with timed(load_timings, 'group stats'):
+        group_stats = GroupStats(full_data)
+
+
+if __name__ == '__main__':
+    # Build step: rebuild the snapshot and report the startup time with and without it
+    # --chunked ingests the world data in chunks even if it is small enough to be cleaned in memory
+    chunked = '--chunked' in sys.argv[1:] or needs_chunked_ingest()
+    dataset_version = data_hash()
+    stage_seconds = {}
+    start = time.perf_counter()
+    if chunked:
+        snapshot_file = write_snapshot_chunked(dataset_version, stage_seconds)
+    else:
+        snapshot_file = write_snapshot(build_full_data(timings=stage_seconds), dataset_version)
+    etl_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    built_data = read_snapshot(snapshot_file)
+    snapshot_seconds = time.perf_counter() - start
+
+    print(f'Wrote {snapshot_file} ({os.path.getsize(snapshot_file)} bytes)')
+    print(f'CSV pipeline: {etl_seconds * 1000:.1f} ms '
+          f'({", ".join(f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in stage_seconds.items())})')
+    print(f'Snapshot load: {snapshot_seconds * 1000:.1f} ms')
+    for source, countries in built_data.attrs['unmatched_countries'].items():
+        if countries:
+            print(f'{source}: {len(countries)} countries could not be matched: {", ".join(countries)}')
+    for column, count in built_data.attrs['coerced_to_nan'].items():
+        if count:
+            print(f'{column}: {count} cells could not be parsed and were set to NaN')
@@ -0,0 +1,250 @@
+import glob
+import json
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from pyarrow import feather
+
+from helper import DATA_DIR, SNAPSHOT_DIR, SOURCES, Source, add_country_key, build_country_index, read_source
+
+HISTORY_DIR = os.path.join(SNAPSHOT_DIR, 'history')
+MANIFEST_PATH = os.path.join(HISTORY_DIR, 'manifest.json')
+
+# Bump this whenever reading or reshaping the report files changes, so every file is ingested again
+HISTORY_VERSION = 3
+
+# Yearly World Happiness Report files, they are ingested in sorted order
+HISTORY_PATTERN = 'WHR*.csv'
+
+# Report year of files that have neither a year column nor a year in their name
+SOURCE_YEARS = {
+    # The 2023 report in the semicolon separated export format
+    'WHR-historical.csv': 2023,
+}
+
+# Encoding and separator of the report files that are known, the format of other files is detected from their header
+REPORT_FORMATS = {
+    'WHR-historical.csv': ('utf-8-sig', ';'),
+}
+
+# Columns of the long format table, keyed by their name in the report files
+HISTORY_COLUMNS = {
+    'Country name': 'Country name',
+    'Ladder score': 'Happiness Score',
+    'Logged GDP per capita': 'Logged GDP per capita',
+    'Social support': 'Social support',
+    'Healthy life expectancy': 'Healthy life expectancy',
+    'Freedom to make life choices': 'Freedom to make life choices',
+    'Generosity': 'Generosity',
+    'Perceptions of corruption': 'Perceptions of corruption',
+}
+
+# Dtypes of the report columns that are read, the multi-year panel calls the happiness score 'Life Ladder'
+REPORT_DTYPES = {
+    'Country name': str,
+    'Ladder score': 'float64',
+    'Life Ladder': 'float64',
+    'year': 'int64',
+    **{column: 'float64' for column in list(HISTORY_COLUMNS)[2:]},
+}
+
+
+def report_format(path):
+    """Encoding and separator of a report file, with or without BOM and separated by commas or semicolons."""
+    name = os.path.basename(path)
+    if name in REPORT_FORMATS:
+        return REPORT_FORMATS[name]
+    with open(path, encoding='utf-8-sig') as f:
+        header = f.readline()
+    return 'utf-8-sig', ';' if header.count(';') > header.count(',') else ','
+
+
+def read_report(path):
+    """Read the columns of a yearly report file that go into the history, raising ValueError if it has no scores."""
+    name = os.path.basename(path)
+    encoding, separator = report_format(path)
+    header = pd.read_csv(path, sep=separator, encoding=encoding, nrows=0).columns
+    columns = {column: dtype for column, dtype in REPORT_DTYPES.items() if column in header}
+    if 'Country name' not in columns or not {'Ladder score', 'Life Ladder'} & set(columns):
+        raise ValueError(f'{name} needs a \'Country name\' column and a \'Ladder score\' or \'Life Ladder\' column')
+    report = read_source(path, Source(name, columns, encoding, separator))
+    report = report.rename(columns={'Life Ladder': 'Ladder score'})
+
+    if 'year' not in report.columns:
+        year = re.search(r'(19|20)\d{2}', name)
+        if year is None and name not in SOURCE_YEARS:
+            raise ValueError(f'{name} has no year column, add its report year to SOURCE_YEARS')
+        report['year'] = int(year.group()) if year else SOURCE_YEARS[name]
+    return report
+
+
+def to_long_format(report, country_index, alpha_3_codes):
+    """Reduce a report to the long format table: country, ISO-3 code, year and the metrics.
+
+    Returns the table and the country names that could not be matched to a country code, see add_country_key.
+    """
+    columns = [column for column in HISTORY_COLUMNS if column in report.columns]
+    history = report[columns + ['year']].rename(columns={**HISTORY_COLUMNS, 'year': 'Year'})
+    history, unmatched = add_country_key(history, 'Country name', country_index)
+    history.insert(1, 'Country code', history.pop('country-code').map(alpha_3_codes))
+    history.insert(2, 'Year', history.pop('Year').astype('int64'))
+    return history, unmatched
+
+
+def year_path(year):
+    return os.path.join(HISTORY_DIR, f'year={year}.feather')
+
+
+def replace_file(path, write):
+    """Write a file with write(tmp_path) and move it over path, readers see either the old or the new file.
+
+    The temporary file has a unique name, so writers in other threads or processes never write to the same one.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def write_manifest(manifest, path):
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def read_manifest():
+    """Ingested report files by name and the file each year was taken from.
+
+    Both are empty if there is no manifest or it was written by another HISTORY_VERSION.
+    """
+    if not os.path.exists(MANIFEST_PATH):
+        return {}, {}
+    with open(MANIFEST_PATH) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != HISTORY_VERSION:
+        return {}, {}
+    return manifest['files'], {int(year): name for year, name in manifest['years'].items()}
+
+
+def update_history():
+    """Ingest new, changed and removed report files into one Feather partition per year, return the files by name.
+
+    A year is taken from the last file in sorted order that contains it. Files whose size and modification time did
+    not change are skipped, only the years of changed or removed files are rebuilt, from every file that contains
+    them. Adding the file of a new year only parses that file. After a HISTORY_VERSION bump every file is ingested
+    again.
+    """
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    files, owners = read_manifest()
+    # Partitions of an older version, or that no ingested file owns, are rebuilt or removed as well
+    affected = {year for year in history_years() if year not in owners}
+
+    paths = {os.path.basename(path): path for path in sorted(glob.glob(os.path.join(DATA_DIR, HISTORY_PATTERN)))}
+    for name in set(files) - set(paths):
+        affected.update(files.pop(name)['years'])
+    changed = {}
+    for name, path in paths.items():
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        if files.get(name, {}).get('signature') != signature:
+            changed[name] = signature
+            affected.update(files.pop(name, {}).get('years', []))
+    if not changed and not affected:
+        return files
+
+    continent_source = SOURCES['continent_file']
+    continent_file = read_source(os.path.join(DATA_DIR, continent_source.file), continent_source)
+    country_index = build_country_index(continent_file)
+    alpha_3_codes = continent_file.set_index('country-code')['alpha-3']
+
+    def ingest(names):
+        # Files are parsed concurrently, a year only gets its rows from one of them
+        with ThreadPoolExecutor() as pool:
+            reports = pool.map(read_report, [paths[name] for name in names])
+            return {name: to_long_format(report, country_index, alpha_3_codes) for name, report in zip(names, reports)}
+
+    histories = {}
+    for name, (history, unmatched) in ingest(sorted(changed)).items():
+        histories[name] = history
+        files[name] = {'signature': changed[name], 'years': sorted(int(year) for year in history['Year'].unique()),
+                       'unmatched_countries': unmatched}
+        affected.update(files[name]['years'])
+    # Unchanged files that share a rebuilt year are parsed again, they may own it
+    sharing = [name for name in sorted(set(files) - set(changed)) if affected & set(files[name]['years'])]
+    histories.update((name, history) for name, (history, _) in ingest(sharing).items())
+
+    for year in sorted(affected):
+        owner = next((name for name in sorted(files, reverse=True) if year in files[name]['years']), None)
+        if owner is None:
+            owners.pop(year, None)
+            if os.path.exists(year_path(year)):
+                os.remove(year_path(year))
+            continue
+        history = histories[owner]
+        rows = history[history['Year'] == year].sort_values('Country name').reset_index(drop=True)
+        replace_file(year_path(year), lambda tmp_path: feather.write_feather(rows, tmp_path))
+        owners[year] = owner
+
+    manifest = {'version': HISTORY_VERSION, 'files': files,
+                'years': {str(year): owners[year] for year in sorted(owners)}}
+    replace_file(MANIFEST_PATH, lambda tmp_path: write_manifest(manifest, tmp_path))
+    return files
+
+
+_update_lock = threading.Lock()
+_updated = False
+
+
+def update_history_once():
+    """Run update_history on the first call in this process, later calls return without looking at the files.
+
+    The sessions of the app are threads of one process, they wait for the first update instead of each running one.
+    """
+    global _updated
+    with _update_lock:
+        if not _updated:
+            _updated = True
+            update_history()
+
+
+def history_years():
+    """Years available in the history, in ascending order."""
+    return sorted(int(re.search(r'year=(\d+)', path).group(1))
+                  for path in glob.glob(os.path.join(HISTORY_DIR, 'year=*.feather')))
+
+
+def load_year(year):
+    """Load the rows of a single year, only that year's partition is read."""
+    return feather.read_table(year_path(year), memory_map=True).to_pandas()
+
+
+def load_history(years=None):
+    """Load the long format table of the given years (default all), sorted by year.
+
+    attrs['unmatched_countries'] lists the countries that could not be matched to a country code, and are missing
+    from the table, for every report file the years were taken from.
+    """
+    years = history_years() if years is None else sorted(years)
+    if not years:
+        history = pd.DataFrame(columns=['Country name', 'Country code', 'Year', *list(HISTORY_COLUMNS.values())[1:]])
+    else:
+        history = pd.concat([load_year(year) for year in years], ignore_index=True)
+    files, owners = read_manifest()
+    history.attrs['unmatched_countries'] = {owners[year]: files[owners[year]]['unmatched_countries']
+                                            for year in years if year in owners}
+    return history
+
+
+if __name__ == '__main__':
+    for source, entry in update_history().items():
+        print(f'{source}: {", ".join(str(year) for year in entry["years"])}')
+    for source, countries in load_history().attrs['unmatched_countries'].items():
+        if countries:
+            print(f'{source}: {len(countries)} countries could not be matched: {", ".join(countries)}')
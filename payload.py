@@ -0,0 +1,108 @@
+import base64
+import json
+
+import numpy as np
+import plotly.utils
+
+# plotly.js reads binary typed arrays from version 2.28 on, the frontend of Streamlit 1.37 bundles plotly.js 2.30.
+# Base64 deflates worse than the rounded JSON numbers of these charts (see benchmarks/payload.py), so they stay off.
+TYPED_ARRAYS = False
+
+# Every array of the charts is only drawn, so single precision is enough for all of them
+DISPLAY_FLOAT32 = True
+
+# Significant digits of a single precision float, numbers sent as JSON text are rounded to these
+FLOAT32_DIGITS = 7
+
+# Shorter arrays are cheaper as JSON numbers than as base64 with a dtype
+MIN_TYPED_ARRAY_LENGTH = 8
+
+# Integer dtypes plotly.js can decode, from the smallest
+_TYPED_INTEGERS = [np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32]
+
+
+def round_significant(values, digits=FLOAT32_DIGITS):
+    """Round every value to digits significant digits, so the shortest JSON text of the numbers is at most that long."""
+    values = np.asarray(values, dtype=np.float64)
+    exponent = np.zeros(values.shape, dtype=np.int64)
+    nonzero = np.isfinite(values) & (values != 0)
+    exponent[nonzero] = digits - 1 - np.floor(np.log10(np.abs(values[nonzero]))).astype(np.int64)
+    with np.errstate(over='ignore', invalid='ignore'):
+        # Powers of ten are exact up to 10**22, dividing by one rounds correctly, multiplying by its inverse does not
+        scale = 10.0 ** np.abs(exponent)
+        rounded = np.where(exponent >= 0, np.round(values * scale) / scale, np.round(values / scale) * scale)
+    # Subnormal numbers overflow the scale, they are kept as they are
+    return np.where(np.isfinite(rounded) | ~np.isfinite(values), rounded, values)
+
+
+def typed_array(values, float32=DISPLAY_FLOAT32):
+    """The base64 typed array spec of plotly.js for a numeric array, None if plotly.js has no dtype for it."""
+    if values.dtype.kind == 'f':
+        dtype = np.float32 if float32 else np.float64
+    else:
+        dtype = next((integer for integer in _TYPED_INTEGERS
+                      if values.size == 0 or (np.iinfo(integer).min <= values.min()
+                                              and values.max() <= np.iinfo(integer).max)), None)
+        if dtype is None:
+            return None
+    spec = {'dtype': np.dtype(dtype).str[1:],
+            'bdata': base64.b64encode(np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder('<'))).decode()}
+    if values.ndim > 1:
+        spec['shape'] = ', '.join(str(length) for length in values.shape)
+    return spec
+
+
+def numeric_array(values):
+    """values as a numeric numpy array, or None if they are not an array of numbers."""
+    if isinstance(values, (list, tuple)):
+        if not values or not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+            return None
+        values = np.asarray(values)
+    if not isinstance(values, np.ndarray) or values.dtype.kind not in 'iuf':
+        return None
+    return values
+
+
+def _compact_properties(properties, typed_arrays, float32, rounded):
+    for name, value in properties.items():
+        if isinstance(value, dict):
+            _compact_properties(value, typed_arrays, float32, rounded)
+            continue
+        values = numeric_array(value)
+        if values is None:
+            continue
+        spec = typed_array(values, float32) if typed_arrays and values.size >= MIN_TYPED_ARRAY_LENGTH else None
+        if spec is not None:
+            properties[name] = spec
+        elif float32 and values.dtype.kind == 'f':
+            rounded.append((properties, name, values))
+
+
+def compact(figure_json, typed_arrays=TYPED_ARRAYS, float32=DISPLAY_FLOAT32):
+    """Shrink the JSON of a figure (figure.to_plotly_json()) in place and return it.
+
+    The trace defaults of the template are only kept for the trace types the figure has, they are the biggest part
+    of small figures and the same in every one. Numeric arrays of the traces become typed arrays if typed_arrays is
+    set, with float32 their floats are sent in single precision.
+    """
+    template_data = figure_json['layout'].get('template', {}).get('data')
+    if template_data:
+        trace_types = {trace.get('type', 'scatter') for trace in figure_json['data']}
+        figure_json['layout']['template']['data'] = {trace_type: defaults for trace_type, defaults
+                                                     in template_data.items() if trace_type in trace_types}
+
+    rounded = []
+    for trace in figure_json['data']:
+        _compact_properties(trace, typed_arrays, float32, rounded)
+    if rounded:
+        # Charts like the indicator grid have hundreds of short arrays, they are rounded in one pass
+        values = round_significant(np.concatenate([array.ravel() for _, _, array in rounded]))
+        offsets = np.cumsum([array.size for _, _, array in rounded])[:-1]
+        for (properties, name, array), part in zip(rounded, np.split(values, offsets)):
+            properties[name] = part.reshape(array.shape)
+    return figure_json
+
+
+def to_json(figure, typed_arrays=TYPED_ARRAYS, float32=DISPLAY_FLOAT32):
+    """The Plotly JSON of a figure, as it is sent to the browser."""
+    return json.dumps(compact(figure.to_plotly_json(), typed_arrays, float32), cls=plotly.utils.PlotlyJSONEncoder)
@@ -0,0 +1,118 @@
+"""Pre-render the charts of the data story, for the default widget values and a grid of filter values.
+
+Every chart is built in a pool of worker processes and written as a Plotly JSON spec named by its content hash,
+next to a manifest that maps the cache keys of the app onto the files. The app serves these specs instead of
+building the figures while the dataset and the chart code are those of the export.
+
+Run from the repository root: python prerender.py --scores 0,4,5,6,7 --region-combinations
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import figures
+from charts import DOWNSAMPLE_THRESHOLD, indicators_render_mode
+from correlation import METHODS
+from figure_cache import PRERENDERED_DIR, PRERENDERED_MANIFEST, figure_name, manifest_key, serialize
+from helper import filter_index, full_data
+from history import history_years, load_history, update_history
+
+
+def figure_requests(scores, region_combinations):
+    """The figure functions and their arguments for every chart to pre-render."""
+    continents = list(filter_index.continent_masks)
+    if region_combinations:
+        selections = [list(combination) for size in range(1, len(continents) + 1)
+                      for combination in itertools.combinations(continents, size)]
+    else:
+        # 'All' and every single continent
+        selections = [continents] + [[continent] for continent in continents]
+
+    requests = [('continent_plot', ()), ('top_countries_plot', ())]
+    for score, selection in itertools.product(scores, selections):
+        # The sub-region filter of the page defaults to every sub-region of the selected continents
+        requests.append(('happiness_map_plot', (score, selection)))
+        requests.append(('region_plot', (score, selection, filter_index.regions_of(selection))))
+
+    render_mode = indicators_render_mode(len(full_data), len(figures.DEFAULT_METRICS))
+    for method in METHODS:
+        requests.append(('indicators_plot', (figures.DEFAULT_METRICS, method, render_mode, DOWNSAMPLE_THRESHOLD)))
+
+    years = history_years()
+    if len(years) > 1:
+        all_countries = set(load_history(years)['Country name'])
+        requests.append(('happiness_history_plot', (years,)))
+        requests.append(('happiness_trend_plot', (years, [country for country in figures.DEFAULT_TREND_COUNTRIES
+                                                          if country in all_countries])))
+    return requests
+
+
+def render(request):
+    """Build one chart in a worker process and return its manifest key and spec."""
+    name, args = request
+    figure_request = getattr(figures, name)(*args)
+    return manifest_key(figure_request.key), figure_name(figure_request.key), serialize(figure_request.build()).spec
+
+
+def write_atomic(path, text):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def prerender(requests, directory=PRERENDERED_DIR, workers=None):
+    """Render the requests in parallel and write the specs and the manifest, returns the number of new files."""
+    os.makedirs(directory, exist_ok=True)
+    # Forked workers share the dataset the parent process already loaded
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    files = {}
+    new_files = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        for key, name, spec in pool.map(render, requests):
+            file = f'{name}-{hashlib.sha256(spec.encode()).hexdigest()[:16]}.json'
+            # Equal specs share a file, and a file that exists already has this content
+            if not os.path.exists(os.path.join(directory, file)):
+                write_atomic(os.path.join(directory, file), spec)
+                new_files += 1
+            files[key] = file
+
+    write_atomic(os.path.join(directory, PRERENDERED_MANIFEST),
+                 json.dumps({'version': figures.FIGURES_VERSION, 'figures': files}, indent=2))
+
+    # Specs of older exports are only removed once the new manifest no longer points at them
+    for file in os.listdir(directory):
+        if file.endswith('.json') and file != PRERENDERED_MANIFEST and file not in files.values():
+            os.remove(os.path.join(directory, file))
+    return new_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scores', default='0',
+                        help='comma separated minimum happiness scores of the slider to pre-render (default 0)')
+    parser.add_argument('--region-combinations', action='store_true',
+                        help='every combination of continents instead of all of them and each single one')
+    parser.add_argument('--workers', type=int, help='worker processes (default one per CPU)')
+    parser.add_argument('--output', default=PRERENDERED_DIR, help=f'output directory (default {PRERENDERED_DIR})')
+    args = parser.parse_args()
+
+    try:
+        update_history()
+    except OSError:
+        pass
+
+    requests = figure_requests([float(score) for score in args.scores.split(',')], args.region_combinations)
+    start = time.perf_counter()
+    new_files = prerender(requests, args.output, args.workers)
+    print(f'Rendered {len(requests)} figures in {time.perf_counter() - start:.1f} s, {new_files} new files in '
+          f'{args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+# Set to 1 to log one JSON line with the timings and counters of every rerun
+LOG_ENV_VAR = 'HAPPY_PROFILE_LOG'
+
+log_enabled = os.environ.get(LOG_ENV_VAR, '') not in ('', '0')
+
+logger = logging.getLogger(__name__)
+if log_enabled:
+    # Streamlit only configures its own loggers, so the trace lines get a handler of their own
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+# Streamlit runs the script of every session in its own thread, so each thread records its own trace
+_local = threading.local()
+
+
+class Trace:
+    """Timed spans and counters of one rerun of the script."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.spans = []
+        self.counters = Counter()
+        self._depth = 0
+
+    def to_dict(self):
+        return {
+            'seconds': self.seconds,
+            'spans': [{'name': name, 'depth': depth, 'seconds': seconds} for name, depth, seconds in self.spans],
+            'counters': dict(self.counters),
+        }
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'index', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        # The span is listed when it starts, so nested spans follow their parent
+        self.index = len(self.trace.spans)
+        self.trace.spans.append((self.name, self.trace._depth, None))
+        self.trace._depth += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        self.trace._depth -= 1
+        self.trace.spans[self.index] = (self.name, self.trace._depth, seconds)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def start_trace():
+    """Start recording the spans and counters of this thread's rerun."""
+    _local.trace = Trace()
+    return _local.trace
+
+
+def end_trace():
+    """Stop recording, log the trace if logging is enabled and return it (None if nothing was recorded)."""
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    if trace is None:
+        return None
+    trace.seconds = time.perf_counter() - trace.start
+    if log_enabled:
+        logger.info(json.dumps(trace.to_dict()))
+    return trace
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+def span(name):
+    """Time a block as part of the current trace, a shared no-op when no trace is recorded."""
+    trace = getattr(_local, 'trace', None)
+    return _Span(trace, name) if trace is not None else _NO_SPAN
+
+
+def count(name, value=1):
+    """Add value to a counter of the current trace, if one is recorded."""
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.counters[name] += value
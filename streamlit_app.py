@@ -1,18 +1,29 @@
-from math import ceil, floor
+import functools
+import logging
 
-import numpy as np
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-import plotly.io as pio
-import plotly.subplots as sp
 import streamlit as st
 
-from helper import continent_color_map, full_data, region_color_map
+import profiling
 
-pio.templates.default = 'simple_white'
+import figures
+from charts import DOWNSAMPLE_THRESHOLD, RENDER_MODES, WEBGL_THRESHOLD, indicators_render_mode
+from correlation import METHODS
+from figure_cache import filtered_figures, plotly_chart, static_figures
+from figures import DEFAULT_METRICS, DEFAULT_TREND_COUNTRIES
+from helper import filter_index, full_data, load_timings
+from history import history_years, load_history, update_history_once
 
 st.set_page_config(layout='wide', page_title='Happiness & Economics', page_icon=':smiley:')
+
+logger = logging.getLogger(__name__)
+
+# ?debug in the URL shows the timings of the rerun in the sidebar, HAPPY_PROFILE_LOG=1 logs them
+debug = 'debug' in st.query_params
+if debug or profiling.log_enabled:
+    profiling.start_trace()
+    st.session_state['reruns'] = st.session_state.get('reruns', 0) + 1
+
 custom_css = """
 <style>
     html, body, [class*="css"] {
@@ -24,51 +35,49 @@ custom_css = """
 # Inject custom CSS with markdown
 st.markdown(custom_css, unsafe_allow_html=True)
 
+try:
+    # Once per process, only parses report files that were added or changed since the last update
+    with profiling.span('update history'):
+        update_history_once()
+except (OSError, ValueError) as error:
+    # Read-only deployments and unreadable report files show the years that were ingested before
+    logger.warning('History not updated: %s', error)
+years = history_years()
+
 WIDE_CONTAINER_COLUMNS = [1, 5, 1]
 SMALL_CONTAINER_COLUMNS = [1, 3, 1]
 BIG_SPACER_HTML = '<br><br><br>'
 SMALL_SPACER_HTML = '<br>'
 
-# Create a container
-container = st.container()
-
-# Create three columns
-_, wide_layout, _ = container.columns(WIDE_CONTAINER_COLUMNS)  # The middle column has more space
 
-# Display the plot in the middle column
-with wide_layout:
+def fragment(section):
+    """Run a section as a Streamlit fragment, so its widgets only rerun that section."""
+    @functools.wraps(section)
+    def traced_section():
+        # A widget of the section reruns only the section, that rerun is traced on its own
+        fragment_rerun = (debug or profiling.log_enabled) and profiling.current_trace() is None
+        if fragment_rerun:
+            profiling.start_trace()
+            st.session_state['reruns'] = st.session_state.get('reruns', 0) + 1
+        with profiling.span(section.__name__):
+            section()
+        if fragment_rerun:
+            trace = profiling.end_trace()
+            if debug:
+                # The sidebar is outside of the fragment, so the timings of its rerun are shown below the section
+                with st.expander(f'Profiling: rerun of {section.__name__}', expanded=True):
+                    trace_tables(trace)
+
+    return st.fragment(traced_section)
+
+
+# The map and the region boxplot share the score slider, so they are one section
+@fragment
+def regions_section():
     small_container = st.container()
     _, small_layout, _ = small_container.columns(SMALL_CONTAINER_COLUMNS)
 
     with small_layout:
-        """
-        # How the economy influences our happiness
-        #### Money can't buy happiness, but it makes living a lot easier. 
-        """
-        st.markdown(SMALL_SPACER_HTML, unsafe_allow_html=True)
-        """
-        ## Disclaimer
-        This data story is a project developed as part of the Data Visualization course at Luzern University of Applied 
-        Sciences and Arts. In the spirit of transparency we would like to disclose that some portions of the text have 
-        been generated with the assistance of ChatGPT. Every text that has been generated with the assistance of
-        ChatGPT have been either edited or completely rewritten by the authors of this data story.
-            
-        The content of this data story is derived from a notebook authored by Lucy Allan. You can find her notebook 
-        [here](https://www.kaggle.com/code/lucyallan/world-happiness-report-2023-data/notebook)
-
-        
-        Names of countries, and their borders are not intended to be a political statement. We are aware that some 
-        countries have disputed borders. We are using the data as it is provided by the datasets!
-        """
-        st.markdown(SMALL_SPACER_HTML, unsafe_allow_html=True)
-        """
-        ## Introduction
-        In our quest to understand what influences happiness around the world, we embark on a data-driven story that 
-        navigates through various indicators of well-being. With the aid of global data, we plot happiness scores 
-        against a myriad of metrics that will give us a better understanding of what makes us happy. We will also 
-        explore the geographic distribution of happiness scores and how they vary across continents. 
-        """
-        st.markdown(SMALL_SPACER_HTML, unsafe_allow_html=True)
         """
         ### Happiness, on a Map?
         The World Happiness Report is a landmark survey of the state of global happiness. The survey is conducted by 
@@ -89,30 +98,15 @@ with wide_layout:
         with st.expander("Change Parameters"):
             min_score = st.slider('Minimum Happiness Score ', 0.0, 10.0, 0.0, 0.01)
 
-            all_regions = full_data["Continent"].unique().tolist()
+            all_regions = list(filter_index.continent_masks)
             map_selected_regions = st.multiselect('Selected regions', ['All'] + all_regions, "All",
                                                   key="map_selected_regions")
 
             if 'All' in map_selected_regions or map_selected_regions == []:
                 map_selected_regions = all_regions
 
-            map_displayed_data = full_data[(full_data['Happiness Score'] > min_score)
-                                           & (full_data['Continent'].isin(map_selected_regions))]
-
-    happiness_map_plot = px.choropleth(map_displayed_data,
-                                       locations="Country name",
-                                       locationmode='country names',
-                                       color="Happiness Score",
-                                       hover_name="Country name",
-                                       hover_data=['Happiness Score'],
-                                       color_continuous_scale='viridis',
-                                       height=800)
-
-    happiness_map_plot.update_geos(showocean=True, oceancolor="#fffec6")
-    happiness_map_plot.update_layout(dragmode=False)
-    happiness_map_plot.update_traces(marker_line_width=0)
-
-    st.plotly_chart(happiness_map_plot, use_container_width=True, theme=None)
+    happiness_map_plot = figures.happiness_map_plot(min_score, map_selected_regions).get()
+    plotly_chart(happiness_map_plot, use_container_width=True, theme=None)
 
     small_container = st.container()
     _, small_layout, _ = small_container.columns(SMALL_CONTAINER_COLUMNS)
@@ -123,22 +117,18 @@ with wide_layout:
         Europe, North America and Oceania. The countries with the lowest happiness score are in Africa, the Middle
         East and South Asia.
         """
+
+    small_container = st.container()
+    _, small_layout, _ = small_container.columns(SMALL_CONTAINER_COLUMNS)
+
+    with small_layout:
         st.markdown(SMALL_SPACER_HTML, unsafe_allow_html=True)
         """
         ### Where are the happiest people?
         """
 
-        continent_order = {"Continent": full_data.groupby("Continent")["Happiness Score"].median()
-        .sort_values(ascending=False).index.tolist()}
-
-        continent_plot = px.box(full_data, y='Continent', x='Happiness Score', color='Continent', height=600,
-                                orientation='h',
-                                color_discrete_map=continent_color_map, category_orders=continent_order,
-                                hover_data=['Country name'])
-
-        continent_plot.update_layout(xaxis_title='Happiness Score', yaxis_title='Continent')
-        continent_plot.update_layout(autosize=True)
-        st.plotly_chart(continent_plot, use_container_width=True, theme=None)
+        continent_plot = figures.continent_plot().get()
+        plotly_chart(continent_plot, use_container_width=True, theme=None)
 
         """
         Oceanica is by far the happiest continent. But this is not a fair comparison, because Oceanica only has 2 
@@ -163,8 +153,7 @@ with wide_layout:
             if 'All' in box_selected_regions or box_selected_regions == []:
                 box_selected_regions = all_regions
 
-            all_eligible_sub_regions = full_data[full_data["Continent"].isin(box_selected_regions)][
-                "Region"].unique().tolist()
+            all_eligible_sub_regions = filter_index.regions_of(box_selected_regions)
             box_selected_sub_regions = st.multiselect('Selected sub-regions', ['All'] + all_eligible_sub_regions,
                                                       ["All"],
                                                       key="box_selected_sub_regions")
@@ -172,53 +161,8 @@ with wide_layout:
             if 'All' in box_selected_sub_regions or box_selected_sub_regions == []:
                 box_selected_sub_regions = all_eligible_sub_regions
 
-            box_displayed_data = full_data[(full_data['Happiness Score'] > min_score)
-                                           & (full_data['Continent'].isin(box_selected_regions)
-                                              & (full_data['Region'].isin(box_selected_sub_regions)))]
-
-    region_order = {"Region": box_displayed_data.groupby("Region")["Happiness Score"].median()
-    .sort_values(ascending=False).index.tolist()}
-
-    region_plot = px.box(box_displayed_data, y='Region', x='Happiness Score', color='Region', height=1200,
-                         orientation='h', color_discrete_map=region_color_map,
-                         category_orders=region_order, hover_data=['Country name'])
-
-    region_plot.update_layout(yaxis_title='Sub Region', xaxis_title='Happiness Score', autosize=True)
-    if len(box_selected_sub_regions) == len(all_eligible_sub_regions) and len(box_selected_regions) == len(all_regions):
-        text = """<span style='font-size:28px; color:#0e1117'>The West</span>"""
-        region_plot.add_annotation(
-            x=5.5, y=12.7,  # Text annotation position
-            xref="x", yref="y",  # Coordinate reference system
-            text=text,  # Text content
-            showarrow=False,
-        )
-
-        region_plot.add_shape(
-            type="rect",
-            x0=4.9, y0=13.5, x1=8, y1=7.5,  # Define the coordinates of the rectangle's corners
-            line=dict(
-                color="#0e1117",
-                width=5,
-            ),
-            opacity=1,
-            fillcolor="rgba(0, 0, 0, 0)",
-        )
-
-        region_plot.add_annotation(
-            x=2.37, y=3.1,
-            xref="x", yref="y",  # Coordinate reference system
-            text="Lebanon",  # Text content
-            arrowcolor="#0e1117",
-        )
-
-        region_plot.add_annotation(
-            x=1.834, y=1.1,
-            xref="x", yref="y",  # Coordinate reference system
-            text="Afghanistan",  # Text content
-            arrowcolor="#0e1117",
-        )
-
-    st.plotly_chart(region_plot, use_container_width=True, theme=None)
+    region_plot = figures.region_plot(min_score, box_selected_regions, box_selected_sub_regions).get()
+    plotly_chart(region_plot, use_container_width=True, theme=None)
 
     small_container = st.container()
     _, small_layout, _ = small_container.columns(SMALL_CONTAINER_COLUMNS)
@@ -232,49 +176,41 @@ with wide_layout:
         plagued by political instability and poverty for decades. South Asia is home to some of the poorest countries 
         in the world.
         """
-        st.markdown(SMALL_SPACER_HTML, unsafe_allow_html=True)
-        """
-        ### The Extremes
-        """
 
-        # Creating top 10 and bottom 10 data frames and concatinating them
-        top10 = full_data.set_index('Country name')['Happiness Score'].nlargest(5).to_frame()
-        bottom10 = full_data.set_index('Country name')['Happiness Score'].nsmallest(5).to_frame()
-        df_concat = pd.concat([top10, bottom10], axis=0)
-        df_concat = df_concat.sort_values(by="Happiness Score")
-
-        # bar chart horizontal
-        top_countries_plot = px.bar(df_concat, x="Happiness Score", y=df_concat.index, orientation='h', height=600,
-                                    color='Happiness Score', color_continuous_scale='viridis')
-        top_countries_plot.update_layout(xaxis_title='Happiness Score', yaxis_title='Country name')
-        top_countries_plot.update_layout(autosize=True)
-
-        top_countries_plot.add_annotation(  # add a text callout with arrow
-            text="Neighbours!", x=7.5, y=3, showarrow=False
-        )
-
-        top_countries_plot.add_shape(
-            type="path",
-            path="M 2.5, 1 Q 8,2 7.6,6",
-            line=dict(
-                color="#0e1117",
-                width=2,
-            ),
-            fillcolor="rgba(0, 0, 0, 0)",
-            opacity=1
-        )
-
-        st.plotly_chart(top_countries_plot, use_container_width=True, theme=None)
 
-        """
-        Finland is leading as the happiest country with a score of 7.804, followed closely by Denmark, Iceland, Israel, 
-        and the Netherlands in the top five. All of these countries are part of the developed world. Conversely, at the 
-        other end of the spectrum, Afghanistan occupies the lowest position, ranking as the unhappiest country with a 
-        significantly lower score of 1.859. Lebanon, Sierra Leone, Zimbabwe, and Botswana also find themselves among 
-        the unhappiest nations, with scores ranging from 2.392 to 3.435. A very interesting observation is that Israel 
-        and Lebanon are neighbors but have a very different happiness score.
-        """
+@fragment
+def history_section():
+    with profiling.span('load history'):
+        history = load_history()
+
+    small_container = st.container()
+    _, small_layout, _ = small_container.columns(SMALL_CONTAINER_COLUMNS)
+
+    with small_layout:
         st.markdown(SMALL_SPACER_HTML, unsafe_allow_html=True)
+        st.markdown(f"""
+        ### Happiness over the years
+        The World Happiness Report is published every year. Press play to see how the happiness scores changed 
+        from {years[0]} to {years[-1]}.
+        """)
+
+    happiness_history_plot = figures.happiness_history_plot(years).get()
+    plotly_chart(happiness_history_plot, use_container_width=True, theme=None)
+
+    with st.columns(SMALL_CONTAINER_COLUMNS)[1]:
+        all_countries = sorted(history['Country name'].unique())
+        trend_countries = st.multiselect('Compare countries', all_countries,
+                                         [country for country in DEFAULT_TREND_COUNTRIES if country in all_countries])
+        happiness_trend_plot = figures.happiness_trend_plot(years, trend_countries).get()
+        plotly_chart(happiness_trend_plot, use_container_width=True, theme=None)
+
+
+@fragment
+def indicators_section():
+    small_container = st.container()
+    _, small_layout, _ = small_container.columns(SMALL_CONTAINER_COLUMNS)
+
+    with small_layout:
         """
         ### What Factors Influence Happiness the most?
         
@@ -289,72 +225,126 @@ with wide_layout:
         all_metrics.remove('Happiness Score')
 
         with st.expander("Change Parameters"):
-            default_metrics = ['Social support',
-                               'Logged GDP per capita',
-                               'Healthy life expectancy',
-                               'Tertiary education enrollment',
-                               'Infant mortality',
-                               'Birth Rate',
-                               'Physicians per thousand',
-                               'Freedom to make life choices',
-                               'Urban population percentage',
-                               'Maternal mortality ratio',
-                               'Co2-Emissions per capita',
-                               'Minimum wage']
-            selected_metrics = st.multiselect('correlation_scatter', all_metrics, default_metrics)
+            selected_metrics = st.multiselect('correlation_scatter', all_metrics, DEFAULT_METRICS)
+            correlation_method = st.selectbox('Correlation method', METHODS)
+            render_mode_labels = {'Automatic': 'auto', **{label: mode for mode, label in RENDER_MODES.items()}}
+            requested_render_mode = render_mode_labels[st.selectbox('Rendering', render_mode_labels)]
+            max_points = st.number_input('Down-sample above (points per plot)', min_value=100,
+                                         value=DOWNSAMPLE_THRESHOLD, step=100)
 
     if not selected_metrics:
-        selected_metrics = default_metrics
-
-    num_cols = 3
-    num_rows = ceil(len(selected_metrics) / num_cols)
-
-    # Create a subplot figure with titles
-    indicators_plot = sp.make_subplots(rows=num_rows, cols=num_cols, subplot_titles=selected_metrics,
-                                       horizontal_spacing=0.05, vertical_spacing=0.06)
-
-    # Add each scatter plot to the respective column in the subplot
-    for i, selected_metric in enumerate(selected_metrics):
-        correlation = round(np.corrcoef(full_data['Happiness Score'], full_data[selected_metric])[0, 1], 2)
-
-        scatter_plot = px.scatter(full_data, x=selected_metric, y='Happiness Score', color='Continent',
-                                  hover_name='Country name', hover_data=['Happiness Score', selected_metric])
-
-        # Calculate the regression line
-        coefficients = np.polyfit(full_data[selected_metric], full_data['Happiness Score'], 1)
-        m = coefficients[0]
-        b = coefficients[1]
-        y_fit = m * full_data[selected_metric] + b
-
-        regression_line = go.Scatter(
-            x=full_data[selected_metric],
-            y=y_fit,
-            mode='lines',
-            line=dict(color='#0e1117', width=2),
-            name='Trendlinie'
-        )
-        scatter_plot.add_trace(regression_line)
-
-        current_row = floor(i / num_cols) + 1
-        current_col = i % num_cols + 1
-
-        # Loop through traces, add to subplot, and update legend visibility
-        for trace in scatter_plot.data:
-            trace.showlegend = (i == 0)  # Show legend only for the first subplot
-            if trace.name == 'Trendlinie':
-                trace.showlegend = False
-            indicators_plot.add_trace(trace, row=current_row, col=current_col)
-
-        # Update axes titles
-        indicators_plot.update_xaxes(title_text=f"{selected_metric} ({correlation})", row=current_row, col=current_col)
-        indicators_plot.update_yaxes(title_text='Happiness Score', row=current_row, col=current_col)
-
-    # Update the layout if needed, e.g., autosize, or adjusting margins
-    total_cols = len(selected_metrics) // 3 + 1
-    indicators_plot.update_layout(height=350 * total_cols, autosize=True)
+        selected_metrics = DEFAULT_METRICS
+
+    render_mode = indicators_render_mode(len(full_data), len(selected_metrics), requested_render_mode, max_points)
+    indicators_plot = figures.indicators_plot(selected_metrics, correlation_method, render_mode, max_points).get()
 
     # Display the figure in the Streamlit app
-    st.plotly_chart(indicators_plot, use_container_width=True, theme=None)
+    plotly_chart(indicators_plot, use_container_width=True, theme=None)
+    st.caption(f"Rendered as {RENDER_MODES[render_mode]} ({len(full_data)} countries per plot, WebGL above "
+               f"{WEBGL_THRESHOLD} points in total, down-sampled above {max_points} points per plot)")
+
+
+@fragment
+def dataset_section():
+    # Below the fold, the table is only sent when a reader asks for it
+    if st.toggle("Show the cleaned dataset used in this data story"):
+        st.dataframe(full_data)
+
+
+def trace_tables(trace):
+    """Run time, spans and counters of a traced rerun."""
+    st.metric('Rerun', f'{trace.seconds * 1000:.1f} ms', help=f"Rerun {st.session_state['reruns']} of this session")
+    st.dataframe(pd.DataFrame({'span': ['\u2003' * depth + name for name, depth, _ in trace.spans],
+                               'ms': [seconds * 1000 for _, _, seconds in trace.spans]}),
+                 hide_index=True, use_container_width=True)
+    st.dataframe(pd.Series(trace.counters, name='value', dtype='int64'), use_container_width=True)
+
+
+def debug_panel(trace):
+    """Timings and counters of this rerun, and the process-wide startup and cache statistics."""
+    with st.sidebar:
+        st.subheader('Profiling')
+        st.caption('Last rerun of the whole page, a rerun of a single section is shown below that section')
+        trace_tables(trace)
+
+        st.caption('Startup of this process')
+        st.dataframe(pd.Series(load_timings, name='ms', dtype='float64') * 1000, use_container_width=True)
+        st.caption('Figure caches of this process')
+        st.dataframe(pd.DataFrame({name: {'entries': len(cache), 'bytes': cache.size, 'hits': cache.hits,
+                                          'misses': cache.misses}
+                                   for name, cache in (('static', static_figures), ('filtered', filtered_figures))}),
+                     use_container_width=True)
+
+
+# Create a container
+container = st.container()
+
+# Create three columns
+_, wide_layout, _ = container.columns(WIDE_CONTAINER_COLUMNS)  # The middle column has more space
+
+# Display the plot in the middle column
+with wide_layout:
+    small_container = st.container()
+    _, small_layout, _ = small_container.columns(SMALL_CONTAINER_COLUMNS)
+
+    with small_layout:
+        """
+        # How the economy influences our happiness
+        #### Money can't buy happiness, but it makes living a lot easier. 
+        """
+        st.markdown(SMALL_SPACER_HTML, unsafe_allow_html=True)
+        """
+        ## Disclaimer
+        This data story is a project developed as part of the Data Visualization course at Luzern University of Applied 
+        Sciences and Arts. In the spirit of transparency we would like to disclose that some portions of the text have 
+        been generated with the assistance of ChatGPT. Every text that has been generated with the assistance of
+        ChatGPT have been either edited or completely rewritten by the authors of this data story.
+            
+        The content of this data story is derived from a notebook authored by Lucy Allan. You can find her notebook 
+        [here](https://www.kaggle.com/code/lucyallan/world-happiness-report-2023-data/notebook)
+
+        
+        Names of countries, and their borders are not intended to be a political statement. We are aware that some 
+        countries have disputed borders. We are using the data as it is provided by the datasets!
+        """
+        st.markdown(SMALL_SPACER_HTML, unsafe_allow_html=True)
+        """
+        ## Introduction
+        In our quest to understand what influences happiness around the world, we embark on a data-driven story that 
+        navigates through various indicators of well-being. With the aid of global data, we plot happiness scores 
+        against a myriad of metrics that will give us a better understanding of what makes us happy. We will also 
+        explore the geographic distribution of happiness scores and how they vary across continents. 
+        """
+        st.markdown(SMALL_SPACER_HTML, unsafe_allow_html=True)
+
+    regions_section()
+
+    if len(years) > 1:
+        history_section()
+
+    small_container = st.container()
+    _, small_layout, _ = small_container.columns(SMALL_CONTAINER_COLUMNS)
+
+    with small_layout:
+        st.markdown(SMALL_SPACER_HTML, unsafe_allow_html=True)
+        """
+        ### The Extremes
+        """
+
+        top_countries_plot = figures.top_countries_plot().get()
+        plotly_chart(top_countries_plot, use_container_width=True, theme=None)
+
+        """
+        Finland is leading as the happiest country with a score of 7.804, followed closely by Denmark, Iceland, Israel, 
+        and the Netherlands in the top five. All of these countries are part of the developed world. Conversely, at the 
+        other end of the spectrum, Afghanistan occupies the lowest position, ranking as the unhappiest country with a 
+        significantly lower score of 1.859. Lebanon, Sierra Leone, Zimbabwe, and Botswana also find themselves among 
+        the unhappiest nations, with scores ranging from 2.392 to 3.435. A very interesting observation is that Israel 
+        and Lebanon are neighbors but have a very different happiness score.
+        """
+        st.markdown(SMALL_SPACER_HTML, unsafe_allow_html=True)
+
+    indicators_section()
 
     small_container = st.container()
     _, small_layout, _ = small_container.columns(SMALL_CONTAINER_COLUMNS)
@@ -401,5 +391,9 @@ with wide_layout:
     - [Global Country Information 2023](https://www.kaggle.com/datasets/nelgiriyewithana/countries-of-the-world-2023)
     - [Continent2](https://www.kaggle.com/datasets/semihizinli/continent2)
     """
-    with st.expander("Cleaned dataset used in this data story"):
-        st.dataframe(full_data)
+
+    dataset_section()
+
+trace = profiling.end_trace()
+if debug and trace is not None:
+    debug_panel(trace)